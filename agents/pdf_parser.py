@@ -2,49 +2,165 @@
 PDF parser for diabetes lab reports using PyMuPDF + GPT-4o-mini
 """
 import os
+import asyncio
+import multiprocessing
 import fitz  # PyMuPDF
-import json
-from typing import Dict, List, Optional
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+from typing import ClassVar, Dict, Iterable, List, Optional
 from pathlib import Path
-from openai import OpenAI
+from openai import AsyncOpenAI
 from rules.schemas.report import PDFExtraction
+from llm.client import get_openai_client, get_request_semaphore, json_schema_format, llm_retry, parse_json_response
+from utils.cache import DiskCache
+
+
+# Derived once at import; asks the API to constrain output to the extraction schema
+_EXTRACTION_RESPONSE_FORMAT = json_schema_format(PDFExtraction, "pdf_extraction")
+
+# Per-process document handle and header/footer margin, set once by each pool worker
+_worker_doc = None
+_worker_margin = 0.0
+
+def _page_text(page, margin: float = 0.0) -> str:
+    """
+    Extract page text block by block
+    
+    A non-zero margin drops blocks lying entirely within that fraction of the
+    page height at the top or bottom (running headers and footers). It is off
+    by default: on lab reports that band often holds sample dates, patient IDs
+    or the last result rows.
+    """
+    top = page.rect.height * margin
+    bottom = page.rect.height * (1 - margin)
+    
+    # Blocks are (x0, y0, x1, y1, text, block_no, block_type); type 1 is an image
+    return "".join(
+        block[4] for block in page.get_text("blocks")
+        if block[6] == 0 and (not margin or (block[3] > top and block[1] < bottom))
+    )
+
+def _init_page_worker(pdf_bytes: bytes, margin: float):
+    """Open the PDF once in each worker process"""
+    global _worker_doc, _worker_margin
+    _worker_doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    _worker_margin = margin
+
+def _extract_page(page_num: int) -> str:
+    """Extract the text of a single page inside a worker process"""
+    return _page_text(_worker_doc[page_num], _worker_margin)
 
 class PDFParser:
     """Parse diabetes lab reports from PDF files"""
     
-    def __init__(self, api_key: str = None):
-        self.client = OpenAI(api_key=api_key or os.getenv('OPENAI_API_KEY'))
+    # Built once so every request sends a byte-identical system prompt
+    _EXTRACTION_PROMPT: ClassVar[str] = """You are a UK diabetes lab-extraction assistant.
+INPUT: raw PDF text (UK lab style).
+OUTPUT: a valid JSON dict with keys:
+{
+ "labs": {
+   "hba1c_pct": float|null, "fpg_mmol": float|null, "ppg2h_mmol": float|null,
+   "egfr": float|null, "creatinine_umol": float|null, "acr_mgmmol": float|null,
+   "lipids": {"tc": float|null, "ldl": float|null, "hdl": float|null, "tg": float|null}
+ },
+ "vitals": {"bp_sys": float|null, "bp_dia": float|null, "hr": float|null},
+ "screenings": {"retina_date": "YYYY-MM-DD"|null, "foot_date": "YYYY-MM-DD"|null, "renal_date": "YYYY-MM-DD"|null},
+ "warnings": ["any extraction warnings"]
+}
+
+Rules: 
+- Convert all glucose to mmol/L, round to 1 dp
+- HbA1c to % if reported in mmol/mol (convert using: % = (mmol/mol + 10.93) / 10.93)
+- Extract only clearly identifiable values
+- Use null for missing/unclear values
+- Add warnings for any ambiguous extractions
+- Return valid JSON only, no other text"""
+    
+    # Labels for each field the extraction prompt asks for, keyed by canonical
+    # field so synonyms (triglyceride/triglycerides, retinal/retinopathy) count once.
+    # Earlier alternatives win, so the ACR label isn't also read as creatinine.
+    LAB_FIELD_PATTERNS: ClassVar[Dict[str, str]] = {
+        "hba1c": r"hba1c|ha?emoglobin a1c",
+        "fpg": r"fasting (?:plasma )?glucose|fpg",
+        "ppg2h": r"(?:2[- ]?h(?:ou)?r?|two[- ]hour|post[- ]?prandial) (?:plasma )?glucose|ppg",
+        "egfr": r"egfr",
+        "acr": r"acr|albumin[:/ ]?creatinine ratio",
+        "creatinine": r"creatinine",
+        "tc": r"total cholesterol",
+        "ldl": r"ldl",
+        "hdl": r"hdl",
+        "tg": r"triglycerides?",
+        "bp": r"blood pressure",
+        "hr": r"heart rate|pulse",
+        "retina": r"retina\w*|retinopathy|eye screening",
+        "foot": r"foot|feet",
+        "renal": r"renal|kidney function",
+    }
+    LAB_PATTERNS: ClassVar[re.Pattern] = re.compile(
+        r"\b(?:" + "|".join(f"(?P<{field}>{pattern})" for field, pattern in LAB_FIELD_PATTERNS.items()) + r")\b",
+        re.IGNORECASE
+    )
+    # Pages extracted ahead of the one being examined, per pool worker
+    PAGES_AHEAD_PER_WORKER = 2
+    
+    def __init__(self, api_key: str = None, num_workers: int = min(os.cpu_count() or 1, 4),
+                 header_footer_margin: float = 0.0):
+        api_key = api_key or os.getenv('OPENAI_API_KEY')
+        self.client = get_openai_client(api_key)
+        # Retries are handled by llm_retry rather than the SDK
+        self.aclient = AsyncOpenAI(api_key=api_key, max_retries=0)
         self.model = "gpt-4o-mini"
+        self.num_workers = num_workers
+        # Opt-in: fraction of page height to drop as running header/footer (e.g. 0.06)
+        self.header_footer_margin = header_footer_margin
+        self.cache = DiskCache(".cache/pdf_extract")
         
-    def extract_text(self, pdf_file) -> tuple[str, Dict]:
-        """Extract text from PDF using PyMuPDF"""
+    def extract_text(self, pdf_file, filename: Optional[str] = None) -> tuple[str, Dict]:
+        """Extract text from PDF using PyMuPDF; pdf_file may be raw bytes, a file-like object or a path"""
         try:
-            # Handle both file path and file-like object
-            if hasattr(pdf_file, 'read'):
+            # Handle raw bytes, file-like objects and file paths
+            if isinstance(pdf_file, (bytes, bytearray, memoryview)):
+                pdf_bytes = pdf_file
+            elif hasattr(pdf_file, 'read'):
                 pdf_bytes = pdf_file.read()
-                doc = fitz.open(stream=pdf_bytes, filetype="pdf")
             else:
-                doc = fitz.open(pdf_file)
+                pdf_bytes = Path(pdf_file).read_bytes()
+            doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+            page_count = len(doc)
             
-            text = ""
-            page_count = 0
-            
-            for page_num in range(len(doc)):
-                page = doc[page_num]
-                page_text = page.get_text()
-                text += f"\n--- Page {page_num + 1} ---\n{page_text}"
-                page_count += 1
-                
-                # Check if this looks like a scanned document
-                if len(page_text.strip()) < 50 and page_count == 1:
-                    return "", {"warning": "Document appears to be scanned - OCR not supported"}
+            # Small documents aren't worth the process spawn overhead
+            if page_count <= 2 or self.num_workers <= 1:
+                page_texts = self._select_pages(_page_text(doc[page_num], self.header_footer_margin) for page_num in range(page_count))
+            else:
+                with ProcessPoolExecutor(
+                    max_workers=min(self.num_workers, page_count),
+                    # Forking the multi-threaded Streamlit server can deadlock the children
+                    mp_context=multiprocessing.get_context("forkserver"),
+                    initializer=_init_page_worker,
+                    initargs=(pdf_bytes, self.header_footer_margin)
+                ) as executor:
+                    page_texts = self._select_pages(self._pooled_page_texts(executor, page_count))
+                    executor.shutdown(wait=False, cancel_futures=True)
             
             doc.close()
             
+            # Check if this looks like a scanned document
+            if page_texts and len(page_texts[0].strip()) < 50:
+                return "", {"warning": "Document appears to be scanned - OCR not supported"}
+            
+            parts: List[str] = [
+                f"--- Page {page_num + 1} ---\n{page_text}"
+                for page_num, page_text in enumerate(page_texts)
+            ]
+            text = "\n".join(parts)
+            
             metadata = {
                 "page_count": page_count,
+                "pages_extracted": len(page_texts),
                 "text_length": len(text),
-                "filename": getattr(pdf_file, 'name', 'uploaded_file')
+                "filename": filename or getattr(pdf_file, 'name', 'uploaded_file')
             }
             
             return text, metadata
@@ -52,6 +168,42 @@ class PDFParser:
         except Exception as e:
             return "", {"error": f"PDF extraction failed: {str(e)}"}
     
+    async def aextract_text(self, pdf_file, filename: Optional[str] = None) -> tuple[str, Dict]:
+        """Async variant of extract_text that keeps the blocking read and parse off the event loop"""
+        # Safe to run in a thread: each call opens its own document and worker pool
+        return await asyncio.to_thread(self.extract_text, pdf_file, filename)
+    
+    def _pooled_page_texts(self, executor: ProcessPoolExecutor, page_count: int) -> Iterable[str]:
+        """Yield page texts in order, keeping only a few pages in flight so an early stop skips the rest"""
+        ahead = self.num_workers * self.PAGES_AHEAD_PER_WORKER
+        pending = deque()
+        next_page = 0
+        
+        while next_page < page_count or pending:
+            while next_page < page_count and len(pending) < ahead:
+                pending.append(executor.submit(_extract_page, next_page))
+                next_page += 1
+            yield pending.popleft().result()
+    
+    def _select_pages(self, page_texts: Iterable[str]) -> List[str]:
+        """
+        Consume page texts in order, stopping early once the lab data is covered
+        
+        Reading stops only once every field the extraction prompt asks for has
+        been seen, so trailing pages such as discharge notes are skipped without
+        risking results that appear later in the document.
+        """
+        selected = []
+        missing_fields = set(self.LAB_FIELD_PATTERNS)
+        
+        for page_text in page_texts:
+            selected.append(page_text)
+            missing_fields.difference_update(m.lastgroup for m in self.LAB_PATTERNS.finditer(page_text))
+            if not missing_fields:
+                break
+        
+        return selected
+    
     def extract_structured_data(self, pdf_text: str) -> PDFExtraction:
         """Extract structured lab data using GPT-4o-mini"""
         if not pdf_text.strip():
@@ -60,47 +212,38 @@ class PDFParser:
                 warnings=["No text extracted from PDF"]
             )
         
-        extraction_prompt = self._get_extraction_prompt()
+        cache_key = self._cache_key(pdf_text)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return self._extraction_from_data(cached)
         
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": extraction_prompt},
-                    {"role": "user", "content": f"PDF Text:\n{pdf_text}"}
-                ],
-                temperature=0.1,
-                max_tokens=1000
-            )
-            
-            result_text = response.choices[0].message.content.strip()
-            
-            # Parse JSON response
-            try:
-                parsed_data = json.loads(result_text)
-                
-                # Calculate confidence based on how many fields were extracted
-                total_possible = 15  # rough count of possible lab values
-                extracted_count = self._count_extracted_fields(parsed_data)
-                confidence = min(1.0, extracted_count / total_possible)
-                
-                return PDFExtraction(
-                    labs=parsed_data.get('labs', {}),
-                    vitals=parsed_data.get('vitals', {}),
-                    screenings=parsed_data.get('screenings', {}),
-                    confidence=confidence,
-                    warnings=parsed_data.get('warnings', []),
-                    provenance={
-                        "extraction_model": self.model,
-                        "extracted_fields": extracted_count
-                    }
-                )
+            response = self._create_completion(**self._extraction_request(pdf_text))
+            return self._build_extraction(response.choices[0].message.content.strip(), cache_key)
                 
-            except json.JSONDecodeError as e:
-                return PDFExtraction(
-                    confidence=0.0,
-                    warnings=[f"Failed to parse extraction JSON: {str(e)}"]
-                )
+        except Exception as e:
+            return PDFExtraction(
+                confidence=0.0,
+                warnings=[f"LLM extraction failed: {str(e)}"]
+            )
+    
+    async def aextract_structured_data(self, pdf_text: str) -> PDFExtraction:
+        """Async variant of extract_structured_data for batching several PDFs"""
+        if not pdf_text.strip():
+            return PDFExtraction(
+                confidence=0.0,
+                warnings=["No text extracted from PDF"]
+            )
+        
+        cache_key = self._cache_key(pdf_text)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return self._extraction_from_data(cached)
+        
+        try:
+            async with get_request_semaphore():
+                response = await self._acreate_completion(**self._extraction_request(pdf_text))
+            return self._build_extraction(response.choices[0].message.content.strip(), cache_key)
                 
         except Exception as e:
             return PDFExtraction(
@@ -108,52 +251,87 @@ class PDFParser:
                 warnings=[f"LLM extraction failed: {str(e)}"]
             )
     
+    @llm_retry
+    def _create_completion(self, **kwargs):
+        """Create a chat completion, retrying transient API errors"""
+        return self.client.chat.completions.create(**kwargs)
+    
+    @llm_retry
+    async def _acreate_completion(self, **kwargs):
+        """Async variant of _create_completion"""
+        return await self.aclient.chat.completions.create(**kwargs)
+    
+    def _extraction_request(self, pdf_text: str) -> Dict:
+        """Build the chat completion arguments for an extraction call"""
+        return {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": self._get_extraction_prompt()},
+                {"role": "user", "content": f"PDF Text:\n{pdf_text}"}
+            ],
+            "temperature": 0.1,
+            "max_tokens": 1000,
+            "response_format": _EXTRACTION_RESPONSE_FORMAT
+        }
+    
+    def _cache_key(self, pdf_text: str) -> str:
+        """Cache key for an extraction: same model, prompt and text give the same result"""
+        return DiskCache.make_key(self.model, self._get_extraction_prompt(), pdf_text)
+    
+    def _build_extraction(self, result_text: str, cache_key: Optional[str] = None) -> PDFExtraction:
+        """Parse the model's JSON response into a PDFExtraction"""
+        try:
+            parsed_data = parse_json_response(result_text)
+        except ValueError as e:
+            return PDFExtraction(
+                confidence=0.0,
+                warnings=[f"Failed to parse extraction JSON: {str(e)}"]
+            )
+        
+        # Cache the raw dict rather than the model to avoid schema version drift
+        if cache_key:
+            self.cache.set(cache_key, parsed_data)
+        
+        return self._extraction_from_data(parsed_data)
+    
+    def _extraction_from_data(self, parsed_data: Dict) -> PDFExtraction:
+        """Build a PDFExtraction from the parsed extraction dict"""
+        # Calculate confidence based on how many fields were extracted
+        total_possible = 15  # rough count of possible lab values
+        extracted_count = self._count_extracted_fields(parsed_data)
+        confidence = min(1.0, extracted_count / total_possible)
+        
+        return PDFExtraction(
+            labs=parsed_data.get('labs', {}),
+            vitals=parsed_data.get('vitals', {}),
+            screenings=parsed_data.get('screenings', {}),
+            confidence=confidence,
+            warnings=parsed_data.get('warnings', []),
+            provenance={
+                "extraction_model": self.model,
+                "extracted_fields": extracted_count
+            }
+        )
+    
     def _get_extraction_prompt(self) -> str:
         """Get the extraction prompt for GPT-4o-mini"""
-        return """You are a UK diabetes lab-extraction assistant.
-INPUT: raw PDF text (UK lab style).
-OUTPUT: a valid JSON dict with keys:
-{
- "labs": {
-   "hba1c_pct": float|null, "fpg_mmol": float|null, "ppg2h_mmol": float|null,
-   "egfr": float|null, "creatinine_umol": float|null, "acr_mgmmol": float|null,
-   "lipids": {"tc": float|null, "ldl": float|null, "hdl": float|null, "tg": float|null}
- },
- "vitals": {"bp_sys": float|null, "bp_dia": float|null, "hr": float|null},
- "screenings": {"retina_date": "YYYY-MM-DD"|null, "foot_date": "YYYY-MM-DD"|null, "renal_date": "YYYY-MM-DD"|null},
- "warnings": ["any extraction warnings"]
-}
-
-Rules: 
-- Convert all glucose to mmol/L, round to 1 dp
-- HbA1c to % if reported in mmol/mol (convert using: % = (mmol/mol + 10.93) / 10.93)
-- Extract only clearly identifiable values
-- Use null for missing/unclear values
-- Add warnings for any ambiguous extractions
-- Return valid JSON only, no other text"""
+        return self._EXTRACTION_PROMPT
     
     def _count_extracted_fields(self, data: Dict) -> int:
         """Count how many fields were successfully extracted"""
-        count = 0
-        
-        labs = data.get('labs', {})
-        count += sum(1 for v in labs.values() if v is not None and v != "")
-        
-        if labs.get('lipids'):
-            count += sum(1 for v in labs['lipids'].values() if v is not None and v != "")
-        
-        vitals = data.get('vitals', {})
-        count += sum(1 for v in vitals.values() if v is not None and v != "")
-        
-        screenings = data.get('screenings', {})
-        count += sum(1 for v in screenings.values() if v is not None and v != "")
-        
-        return count
+        labs = data.get('labs') or {}
+        values = chain(
+            labs.values(),
+            (labs.get('lipids') or {}).values(),
+            (data.get('vitals') or {}).values(),
+            (data.get('screenings') or {}).values()
+        )
+        return sum(1 for v in values if v is not None and v != "")
     
-    def parse_pdf(self, pdf_file) -> PDFExtraction:
+    def parse_pdf(self, pdf_file, filename: Optional[str] = None) -> PDFExtraction:
         """Main method to parse PDF and extract structured data"""
         # Extract text
-        pdf_text, metadata = self.extract_text(pdf_file)
+        pdf_text, metadata = self.extract_text(pdf_file, filename)
         
         if not pdf_text:
             warnings = [metadata.get('warning', metadata.get('error', 'Unknown extraction error'))]
@@ -164,6 +342,19 @@ Rules:
         extraction.provenance.update(metadata)
         
         return extraction
+    
+    async def aparse_pdf(self, pdf_file, filename: Optional[str] = None) -> PDFExtraction:
+        """Async variant of parse_pdf; use asyncio.gather to process several PDFs"""
+        pdf_text, metadata = await self.aextract_text(pdf_file, filename)
+        
+        if not pdf_text:
+            warnings = [metadata.get('warning', metadata.get('error', 'Unknown extraction error'))]
+            return PDFExtraction(confidence=0.0, warnings=warnings)
+        
+        extraction = await self.aextract_structured_data(pdf_text)
+        extraction.provenance.update(metadata)
+        
+        return extraction
 
 if __name__ == "__main__":
     # Test with a sample PDF
@@ -1,27 +1,51 @@
 """
 Report orchestrator for single-pass LLM report generation
 """
-import json
 import os
-from typing import Dict, List, Optional, Tuple
+import uuid
+import orjson
+import asyncio
+from itertools import chain
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 from datetime import datetime
 from pathlib import Path
-from openai import OpenAI
+from openai import AsyncOpenAI
 
 from rules.schemas.report import PatientIntake, ReportOut
 from rag.retriever import RAGRetriever
 from rules import load_rules
 from llm.prompts import get_report_generation_prompt
 from utils.formatters import normalize_patient_data
+from llm.client import (
+    estimate_tokens, get_openai_client, get_rate_limiter, get_request_semaphore, json_schema_format, llm_retry,
+    parse_json_response
+)
+from utils.cache import DiskCache
+
+# Guideline snippets given to the LLM per report, on every generation path
+RETRIEVAL_K = 6
+
+# Derived once at import; asks the API to constrain output to the report schema
+_REPORT_RESPONSE_FORMAT = json_schema_format(ReportOut, "report")
 
 class ReportOrchestrator:
     """Orchestrate single-pass report generation with RAG"""
     
-    def __init__(self, api_key: str = None):
-        self.client = OpenAI(api_key=api_key or os.getenv('OPENAI_API_KEY'))
+    def __init__(self, api_key: str = None, tokens_per_minute: int = 200_000, requests_per_minute: int = 500):
+        api_key = api_key or os.getenv('OPENAI_API_KEY')
+        self.client = get_openai_client(api_key)
+        # Retries are handled by llm_retry rather than the SDK
+        self.aclient = AsyncOpenAI(api_key=api_key, max_retries=0)
         self.model = "gpt-4o-mini"
+        self.temperature = 0.2
+        self.max_tokens = 4000
+        # Tune to the account's OpenAI tier
+        self.rate_limiter = get_rate_limiter(tokens_per_minute, requests_per_minute)
+        self.cache = DiskCache(".cache/report")
         self.rag_retriever = RAGRetriever()
         self.rules = load_rules()
+        # Serialized once so the system prompt is byte-identical across calls
+        self._rules_digest = self._compact_rules(self.rules)
         
     def merge_data_sources(self, form_data: Dict, pdf_data: Dict, conflicts: Dict) -> PatientIntake:
         """
@@ -49,9 +73,10 @@ class ReportOrchestrator:
         
         return PatientIntake(**normalized_data)
     
-    def generate_report(self, patient_data: PatientIntake, max_retries: int = 1) -> Tuple[Optional[ReportOut], List[str]]:
+    def generate_report(self, patient_data: PatientIntake, max_retries: int = 1,
+                        use_cache: bool = True) -> Tuple[Optional[ReportOut], List[str]]:
         """
-        Generate complete report using single LLM call
+        Generate complete report using single LLM call; use_cache=False skips the cached response lookup
         
         Returns:
             - ReportOut object if successful, None if failed
@@ -60,21 +85,24 @@ class ReportOrchestrator:
         errors = []
         
         try:
-            # Build retrieval query and get relevant snippets
-            query = self.rag_retriever.build_retrieval_query(patient_data.dict())
-            snippets = self.rag_retriever.retrieve(query, k=6)
+            # Dump once; the same dict feeds retrieval and the LLM context
+            patient_dict = patient_data.model_dump(mode="json")
+            
+            snippets = self._retrieve_snippets(patient_dict)
             
             # Prepare context for LLM
             context = {
-                "patient_intake": patient_data.dict(),
-                "rules": self.rules,
+                "patient_intake": patient_dict,
                 "retrieved_snippets": snippets
             }
             
             # Generate report with retry logic
             for attempt in range(max_retries + 1):
                 try:
-                    report_json = self._call_llm_for_report(context)
+                    cache_key = self._cache_key(context)
+                    report_json = self.cache.get(cache_key) if cache_key and use_cache else None
+                    if report_json is None:
+                        report_json = self._call_llm_for_report(context)
                     
                     # Validate and parse
                     report = ReportOut(**report_json)
@@ -83,6 +111,10 @@ class ReportOrchestrator:
                     if not self._validate_citations(report, snippets):
                         errors.append("Some citations are invalid")
                     
+                    # Only cache responses that passed schema validation
+                    if cache_key:
+                        self.cache.set(cache_key, report_json)
+                    
                     return report, errors
                     
                 except Exception as e:
@@ -101,25 +133,192 @@ class ReportOrchestrator:
         
         return None, errors
     
+    async def agenerate_report(self, patient_data: PatientIntake, max_retries: int = 1) -> Tuple[Optional[ReportOut], List[str]]:
+        """Async variant of generate_report for generating several reports concurrently"""
+        errors = []
+        
+        try:
+            patient_dict = patient_data.model_dump(mode="json")
+            snippets = await self._aretrieve_snippets(patient_dict)
+            
+            context = {
+                "patient_intake": patient_dict,
+                "retrieved_snippets": snippets
+            }
+            
+            for attempt in range(max_retries + 1):
+                try:
+                    cache_key = self._cache_key(context)
+                    report_json = self.cache.get(cache_key) if cache_key else None
+                    if report_json is None:
+                        report_json = await self._acall_llm_for_report(context)
+                    report = ReportOut(**report_json)
+                    
+                    if not self._validate_citations(report, snippets):
+                        errors.append("Some citations are invalid")
+                    
+                    if cache_key:
+                        self.cache.set(cache_key, report_json)
+                    
+                    return report, errors
+                    
+                except Exception as e:
+                    errors.append(f"Attempt {attempt + 1} failed: {str(e)}")
+                    
+                    if attempt == max_retries:
+                        return None, errors
+                    
+                    context["previous_error"] = str(e)
+            
+        except Exception as e:
+            errors.append(f"Report generation failed: {str(e)}")
+            return None, errors
+        
+        return None, errors
+    
+    async def agenerate_reports(self, patients: List[PatientIntake]) -> List[Tuple[Optional[ReportOut], List[str]]]:
+        """Generate reports for several patients concurrently"""
+        return await asyncio.gather(*(self.agenerate_report(patient) for patient in patients))
+    
+    async def stream_report(self, patient_data: PatientIntake) -> AsyncIterator[Tuple[str, Optional[ReportOut]]]:
+        """
+        Stream report generation so the UI can show progress immediately
+        
+        Yields (text_delta, None) while the model is generating, then a final
+        ("", report) once the full JSON has been parsed and validated.
+        """
+        patient_dict = patient_data.model_dump(mode="json")
+        snippets = await self._aretrieve_snippets(patient_dict)
+        
+        context = {
+            "patient_intake": patient_dict,
+            "retrieved_snippets": snippets
+        }
+        
+        parts = []
+        async for delta in self._astream_completion(context):
+            parts.append(delta)
+            yield delta, None
+        
+        # Only parse once the stream is complete
+        report = ReportOut(**self._parse_report_json("".join(parts)))
+        self._validate_citations(report, snippets)
+        yield "", report
+    
+    def _retrieve_snippets(self, patient_dict: Dict, k: int = RETRIEVAL_K) -> List[Dict]:
+        """Retrieve k distinct snippets covering the labs, lifestyle and medication aspects in one batched search"""
+        queries = self.rag_retriever.build_retrieval_subqueries(patient_dict)
+        # Fetch k per query so there is enough left to top up after de-duplication
+        results = self.rag_retriever.retrieve_batch(queries, k)
+        
+        # Take each query's next-best hit in turn, skipping snippets already taken
+        snippets = {}
+        for rank in range(k):
+            for result in results:
+                if rank < len(result):
+                    snippets.setdefault(result[rank]['id'], result[rank])
+                    if len(snippets) == k:
+                        return list(snippets.values())
+        return list(snippets.values())
+    
+    async def _aretrieve_snippets(self, patient_dict: Dict, k: int = RETRIEVAL_K) -> List[Dict]:
+        """Async counterpart of _retrieve_snippets; the search runs off the event loop"""
+        return await asyncio.to_thread(self._retrieve_snippets, patient_dict, k)
+    
     def _call_llm_for_report(self, context: Dict) -> Dict:
         """Call LLM with structured prompt for report generation"""
+        messages = self._build_messages(context)
+        self.rate_limiter.acquire(self._estimate_request_tokens(messages))
+        
+        stream = self._create_completion(
+            model=self.model,
+            messages=messages,
+            temperature=self.temperature,
+            max_tokens=self.max_tokens,
+            response_format=_REPORT_RESPONSE_FORMAT,
+            stream=True
+        )
+        
+        parts = []
+        for chunk in stream:
+            if chunk.choices:
+                parts.append(chunk.choices[0].delta.content or "")
+        
+        return self._parse_report_json("".join(parts))
+    
+    async def _acall_llm_for_report(self, context: Dict) -> Dict:
+        """Async variant of _call_llm_for_report"""
+        parts = []
+        async for delta in self._astream_completion(context):
+            parts.append(delta)
         
-        prompt = get_report_generation_prompt()
+        return self._parse_report_json("".join(parts))
+    
+    def _estimate_request_tokens(self, messages: List[Dict]) -> int:
+        """Estimate the tokens a request will consume: prompt plus the completion budget"""
+        prompt = "\n".join(message["content"] for message in messages)
+        return estimate_tokens(prompt, self.model) + self.max_tokens
+    
+    @llm_retry
+    def _create_completion(self, **kwargs):
+        """Create a chat completion, retrying transient API errors"""
+        return self.client.chat.completions.create(**kwargs)
+    
+    @llm_retry
+    async def _acreate_completion(self, **kwargs):
+        """Async variant of _create_completion"""
+        return await self.aclient.chat.completions.create(**kwargs)
+    
+    async def _astream_completion(self, context: Dict) -> AsyncIterator[str]:
+        """Stream the report completion, yielding text deltas as they arrive"""
+        messages = self._build_messages(context)
+        
+        async with get_request_semaphore():
+            await self.rate_limiter.aacquire(self._estimate_request_tokens(messages))
+            stream = await self._acreate_completion(
+                model=self.model,
+                messages=messages,
+                temperature=self.temperature,
+                max_tokens=self.max_tokens,
+                response_format=_REPORT_RESPONSE_FORMAT,
+                stream=True
+            )
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+    
+    @staticmethod
+    def _compact_rules(rules: Dict) -> str:
+        """Render rules as a minified reference block numbered R1..Rn"""
+        return "\n".join(
+            f"R{i} {name}={orjson.dumps(value, option=orjson.OPT_SORT_KEYS).decode()}"
+            for i, (name, value) in enumerate(sorted(rules.items()), start=1)
+        )
+    
+    def _cache_key(self, context: Dict) -> Optional[str]:
+        """Cache key for a report request, or None when sampling is too random to cache"""
+        if self.temperature > 0.2:
+            return None
+        messages = self._build_messages(context)
+        return DiskCache.make_key(self.model, orjson.dumps(messages, option=orjson.OPT_SORT_KEYS).decode())
+    
+    def _build_messages(self, context: Dict) -> List[Dict]:
+        """Build the chat messages for report generation"""
+        # Static instructions and rules first so OpenAI can reuse the cached prefix;
+        # per-patient data goes last in the user message
+        system_prompt = f"{get_report_generation_prompt()}\n\nCLINICAL RULES:\n{self._rules_digest}"
         
         # Format context as structured input
         context_str = f"""
 PATIENT DATA:
-{json.dumps(context['patient_intake'], indent=2)}
-
-CLINICAL RULES:
-{json.dumps(context['rules'], indent=2)}
+{orjson.dumps(context['patient_intake']).decode()}
 
 RETRIEVED EVIDENCE:
-{json.dumps(context['retrieved_snippets'], indent=2)}
+{orjson.dumps(context['retrieved_snippets']).decode()}
 """
         
         messages = [
-            {"role": "system", "content": prompt},
+            {"role": "system", "content": system_prompt},
             {"role": "user", "content": context_str}
         ]
         
@@ -130,45 +329,135 @@ RETRIEVED EVIDENCE:
                 "content": f"Previous attempt failed with error: {context['previous_error']}. Please fix and return valid JSON."
             })
         
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            temperature=0.2,
-            max_tokens=4000
-        )
+        return messages
+    
+    def _parse_report_json(self, result_text: str) -> Dict:
+        """Extract and parse the report JSON from the model output"""
+        return parse_json_response(result_text)
+    
+    def submit_batch(self, patients: List[PatientIntake], batch_dir: str = "data/batches") -> str:
+        """
+        Submit report generation for many patients through the OpenAI Batch API
         
-        result_text = response.choices[0].message.content.strip()
+        Batch jobs cost half as much and finish within 24h, so use this for
+        offline back-fills; interactive use should stay on generate_report.
+        Patient uuids must be unique within the batch.
         
-        # Clean and parse JSON
-        if result_text.startswith('```json'):
-            result_text = result_text[7:]
-        if result_text.endswith('```'):
-            result_text = result_text[:-3]
+        Returns:
+            The batch id, to pass to collect_batch once the batch has completed
+        """
+        lines = []
+        snippets_by_patient = {}
         
-        return json.loads(result_text)
+        for patient in patients:
+            patient_dict = patient.model_dump(mode="json")
+            snippets = self._retrieve_snippets(patient_dict)
+            snippets_by_patient[patient.uuid] = snippets
+            
+            context = {
+                "patient_intake": patient_dict,
+                "retrieved_snippets": snippets
+            }
+            lines.append(orjson.dumps({
+                "custom_id": patient.uuid,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": self.model,
+                    "messages": self._build_messages(context),
+                    "temperature": self.temperature,
+                    "max_tokens": self.max_tokens,
+                    "response_format": _REPORT_RESPONSE_FORMAT
+                }
+            }))
+        
+        batch_input = self.client.files.create(
+            file=("batch_input.jsonl", b"\n".join(lines)),
+            purpose="batch"
+        )
+        batch = self.client.batches.create(
+            input_file_id=batch_input.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        
+        # Keep the evidence each patient was given so citations can be checked on collection
+        batch_path = Path(batch_dir) / batch.id
+        batch_path.mkdir(parents=True, exist_ok=True)
+        self._write_json_atomic(batch_path / "snippets.json", snippets_by_patient)
+        
+        return batch.id
     
-    def _validate_citations(self, report: ReportOut, snippets: List[Dict]) -> bool:
-        """Validate that all citation_ids exist in retrieved snippets"""
-        snippet_ids = {snippet['id'] for snippet in snippets}
+    def collect_batch(self, batch_id: str, batch_dir: str = "data/batches") -> Dict[str, Tuple[Optional[ReportOut], List[str]]]:
+        """
+        Collect the reports of a submitted batch
+        
+        Requests that failed, or never ran because the batch expired or was
+        cancelled, come back as (None, errors) entries rather than being dropped.
+        
+        Returns:
+            {patient_uuid: (report, errors)}, or an empty dict while the batch is still running
         
-        # Check all citation_ids in the report
-        all_citation_ids = set()
+        Raises:
+            RuntimeError: if the batch failed validation and no request ran
+        """
+        batch = self.client.batches.retrieve(batch_id)
+        if batch.status in ("validating", "in_progress", "finalizing", "cancelling"):
+            return {}
+        if batch.status == "failed":
+            reasons = "; ".join(error.message for error in ((batch.errors and batch.errors.data) or []) if error.message)
+            raise RuntimeError(f"Batch {batch_id} failed: {reasons or 'no reason given'}")
+        
+        snippets_by_patient = orjson.loads((Path(batch_dir) / batch_id / "snippets.json").read_bytes())
+        # Successful requests land in the output file, failed ones in the error file
+        lines = chain.from_iterable(
+            self.client.files.content(file_id).text.splitlines()
+            for file_id in (batch.output_file_id, batch.error_file_id) if file_id
+        )
         
-        # From lifestyle_plan
-        for rec in report.lifestyle_plan:
-            all_citation_ids.update(rec.citation_ids)
+        results = {}
+        for line in lines:
+            if not line.strip():
+                continue
+            
+            result = orjson.loads(line)
+            patient_uuid = result["custom_id"]
+            response = result.get("response") or {}
+            
+            if result.get("error") or response.get("status_code") != 200:
+                results[patient_uuid] = (None, [f"Batch request failed: {result.get('error') or response.get('body')}"])
+                continue
+            
+            errors = []
+            try:
+                content = response["body"]["choices"][0]["message"]["content"]
+                report = ReportOut(**self._parse_report_json(content))
+                
+                if not self._validate_citations(report, snippets_by_patient.get(patient_uuid, [])):
+                    errors.append("Some citations are invalid")
+                
+                results[patient_uuid] = (report, errors)
+            except Exception as e:
+                errors.append(f"Report generation failed: {str(e)}")
+                results[patient_uuid] = (None, errors)
         
-        # From medication_plan
-        for rec in report.medication_plan:
-            all_citation_ids.update(rec.citation_ids)
+        for patient_uuid in snippets_by_patient:
+            if patient_uuid not in results:
+                results[patient_uuid] = (None, [f"No result returned (batch status: {batch.status})"])
         
-        # From interpretation
-        for interp in report.interpretation:
-            all_citation_ids.update(interp.get('citation_ids', []))
+        return results
+    
+    def _validate_citations(self, report: ReportOut, snippets: List[Dict]) -> bool:
+        """Validate that all citation_ids exist in retrieved snippets"""
+        snippet_ids = frozenset(snippet['id'] for snippet in snippets)
         
-        # From citations list
-        citation_ids_in_list = {cite['id'] for cite in report.citations}
-        all_citation_ids.update(citation_ids_in_list)
+        # Gather citation_ids from every section that carries them in one pass
+        all_citation_ids = set(chain.from_iterable(chain(
+            (rec.citation_ids for rec in report.lifestyle_plan),
+            (rec.citation_ids for rec in report.medication_plan),
+            (interp.get('citation_ids', ()) for interp in report.interpretation),
+            ((cite['id'],) for cite in report.citations)
+        )))
         
         # Check if all citations are valid
         invalid_citations = all_citation_ids - snippet_ids
@@ -179,23 +468,30 @@ RETRIEVED EVIDENCE:
         
         return True
     
-    def save_report(self, patient_uuid: str, report: ReportOut, patient_data: PatientIntake) -> str:
-        """Save report to patient directory"""
+    def save_report(self, patient_uuid: str, report: ReportOut, patient_data: PatientIntake,
+                    report_dict: Optional[Dict] = None) -> str:
+        """Save report to patient directory; pass report_dict to reuse an existing dump"""
         date_str = datetime.now().strftime("%Y-%m-%d")
         patient_dir = Path(f"data/patients/{patient_uuid}/{date_str}")
         patient_dir.mkdir(parents=True, exist_ok=True)
         
-        # Save report JSON
-        report_file = patient_dir / "report.json"
-        with open(report_file, 'w', encoding='utf-8') as f:
-            json.dump(report.dict(), f, indent=2, ensure_ascii=False)
-        
-        # Save patient data
-        patient_file = patient_dir / "patient_data.json"
-        with open(patient_file, 'w', encoding='utf-8') as f:
-            json.dump(patient_data.dict(), f, indent=2, ensure_ascii=False)
+        self._write_json_atomic(patient_dir / "report.json", report_dict or report.model_dump())
+        self._write_json_atomic(patient_dir / "patient_data.json", patient_data.model_dump())
         
         return str(patient_dir)
+    
+    async def asave_report(self, patient_uuid: str, report: ReportOut, patient_data: PatientIntake,
+                           report_dict: Optional[Dict] = None) -> str:
+        """Async variant of save_report that keeps file I/O off the event loop"""
+        return await asyncio.to_thread(self.save_report, patient_uuid, report, patient_data, report_dict)
+    
+    @staticmethod
+    def _write_json_atomic(path: Path, data: Dict):
+        """Write JSON via a temp file and rename, so a crash never leaves a partial file"""
+        # Unique per write, so concurrent saves of the same report never share a temp file
+        tmp_file = path.with_name(f"{path.stem}.{uuid.uuid4().hex}.tmp")
+        tmp_file.write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+        os.replace(tmp_file, path)
 
 if __name__ == "__main__":
     # Test orchestrator
@@ -2,14 +2,25 @@
 Schema-Locked Single-Pass Diabetes Report System
 Main Streamlit application with forms-first intake and consultant-grade reporting
 """
-import json
-import uuid
 import os
-from datetime import datetime, date
+
+# Must run before numpy/FAISS load (streamlit imports numpy via pandas). OpenBLAS
+# threads nested inside OpenMP ones oversubscribe the CPU, and by default idle
+# OpenMP workers spin-wait between searches, burning CPU in this long-lived process.
+os.environ.setdefault("OMP_WAIT_POLICY", "PASSIVE")
+os.environ.setdefault("OMP_NUM_THREADS", str(max(1, (os.cpu_count() or 2) // 2)))
+os.environ.setdefault("OPENBLAS_NUM_THREADS", "1")
+os.environ.setdefault("MKL_NUM_THREADS", "1")
+
+import hashlib
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
 
+import orjson
 import streamlit as st
-import pandas as pd
 from dotenv import load_dotenv
 
 # ────────────────────────────────────────────────────────────────────────────────
@@ -27,41 +38,36 @@ st.set_page_config(
 # ────────────────────────────────────────────────────────────────────────────────
 load_dotenv()  # local dev only; Streamlit Cloud ignores .env
 
-def get_secret(name: str, default=None):
-    # Prefer Streamlit Secrets on Cloud; fall back to OS env for local dev
-    try:
-        val = st.secrets.get(name)
-    except Exception:
-        val = None
-    return val if val is not None else os.getenv(name, default)
+# Imported rather than defined here: app.py re-executes on every rerun, which would reset a cache
+from utils.config import get_secret
+from ui.messages import MISSING_API_KEY_MESSAGE, PYMUPDF_MISSING_MESSAGE, APP_TITLE, APP_SUBTITLE, FOOTER
 
 OPENAI_API_KEY = get_secret("OPENAI_API_KEY")
 CHROMA_PERSIST_DIRECTORY = get_secret("CHROMA_PERSIST_DIRECTORY", "./chroma_db")
 NHS_THEME_PRIMARY = get_secret("NHS_THEME_PRIMARY", "#005EB8")
 NHS_THEME_SECONDARY = get_secret("NHS_THEME_SECONDARY", "#41B6E6")
+# Off by default: a reused report reflects the earlier, slightly different values
+SEMANTIC_REPORT_CACHE = str(get_secret("SEMANTIC_REPORT_CACHE", "false")).lower() == "true"
 
 if not OPENAI_API_KEY:
-    st.error(
-        "⚠️ **OPENAI_API_KEY** not configured.\n\n"
-        "Add it in **Settings → Advanced settings → Secrets** as:\n\n"
-        "```toml\nOPENAI_API_KEY = \"sk-...\"\n```\n"
-        "Then rerun the app."
-    )
+    st.error(MISSING_API_KEY_MESSAGE)
     st.stop()
 
 # ────────────────────────────────────────────────────────────────────────────────
 # 3) App imports (modules from your project)
-#    NOTE: We will lazy-import PDFParser later to avoid hard-crash if PyMuPDF is missing.
+#    NOTE: Heavy modules (OpenAI SDK, FAISS, ReportLab, PyMuPDF) are imported lazily
+#    where first used, so sessions that only fill the form start fast.
 # ────────────────────────────────────────────────────────────────────────────────
-from rules.schemas.report import PatientIntake, ReportOut, PDFExtraction
-from agents.report_orchestrator import ReportOrchestrator
-from rag.index_builder import RAGIndexBuilder
-from rag.retriever import RAGRetriever
+from pydantic import ValidationError
 from rules import load_rules
+from rules.schemas.report import PatientIntake, ReportOut, PDFExtraction
 from utils.formatters import render_text_report, create_clinical_snapshot
-from utils.pdf import PDFGenerator
+from ui.intake import (
+    MEASUREMENTS_DF, MEASUREMENT_MIN, MEASUREMENT_MAX, MEASUREMENT_COLUMN_CONFIG, parse_medications,
+    DEFAULT_DOB, SEX_OPTIONS, DIABETES_TYPE_OPTIONS, SMOKING_OPTIONS, ACTIVITY_OPTIONS, DIET_OPTIONS
+)
 from ui.components import (
-    create_conflict_resolver, create_clinical_snapshot_cards,
+    find_conflicts, create_conflict_resolver, create_clinical_snapshot_cards,
     create_download_button, create_urgent_banner, create_report_tabs,
     create_progress_tracker, create_validation_feedback, display_validation_warnings
 )
@@ -71,64 +77,125 @@ from ui.components import (
 # ────────────────────────────────────────────────────────────────────────────────
 if 'session_id' not in st.session_state:
     st.session_state.session_id = str(uuid.uuid4())
-for k, v in {
+SESSION_DEFAULTS = {
     'patient_data': {},
     'pdf_data': {},
     'conflicts': {},
     'generated_report': None,
-    'report_text': None,
-}.items():
+    'generated_report_dict': None,
+    'report_reused': False,
+    'report_nonce': '',
+    'report_patient_dict': None,
+    'pdf_future': None,
+    'pdf_bytes': None,
+    'pdf_error': None,
+}
+for k, v in SESSION_DEFAULTS.items():
     st.session_state.setdefault(k, v)
 
 # ────────────────────────────────────────────────────────────────────────────────
 # 5) Helpers
 # ────────────────────────────────────────────────────────────────────────────────
+@st.cache_resource
+def _rules():
+    """Clinical rules, parsed once per process and shared read-only across sessions."""
+    return load_rules()
+
+@st.cache_resource
+def get_orchestrator():
+    """Process-wide report orchestrator; keeps the FAISS index and HTTP clients warm."""
+    from agents.report_orchestrator import ReportOrchestrator
+    return ReportOrchestrator()
+
+@st.cache_resource
+def get_semantic_cache():
+    """Process-wide similarity cache of generated reports (opt-in via SEMANTIC_REPORT_CACHE)."""
+    from rag.semantic_cache import SemanticReportCache
+    return SemanticReportCache(api_key=OPENAI_API_KEY)
+
+@st.cache_resource
+def get_pdf_generator():
+    """Process-wide PDF generator; its stylesheet is built once."""
+    from utils.pdf import PDFGenerator
+    return PDFGenerator()
+
+@st.cache_resource
+def get_report_store():
+    """Process-wide SQLite store of generated reports; survives restarts, unlike st.cache_data."""
+    from utils.cache import ReportStore
+    return ReportStore()
+
+def _build_rag_index(api_key: str) -> str:
+    """
+    Make sure the FAISS index exists, building it if needed.
+    Returns the status message; failures raise.
+    """
+    index_path = Path("data/rag")
+    index_path.mkdir(parents=True, exist_ok=True)
+    index_file = index_path / "index.faiss"
+    if index_file.exists():
+        return "✅ Using existing knowledge base"
+
+    # The key is checked by the builder's first embedding request, not a separate round trip
+    from rag.index_builder import RAGIndexBuilder
+    builder = RAGIndexBuilder(api_key=api_key)
+    builder.build_index()
+
+    if not index_file.exists():
+        raise RuntimeError("Failed to create knowledge base index file")
+    return "✅ Knowledge base built successfully"
+
+def _warm_retriever():
+    """Load the orchestrator's FAISS index and run warm-up searches; best effort."""
+    try:
+        get_orchestrator().rag_retriever.warm_up()
+    except Exception as e:
+        print(f"Retriever warm-up failed: {str(e)}")
+
+def _build_and_warm(api_key: str) -> str:
+    """Build the index if needed, then warm the retriever without holding up the result."""
+    status = _build_rag_index(api_key)
+    threading.Thread(target=_warm_retriever, name="rag-warm", daemon=True).start()
+    return status
+
+@st.cache_resource(show_spinner=False)
+def _rag_build(api_key: str) -> Future:
+    """Start the index check/build in the background, once per process; shared by all sessions."""
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rag-build")
+    future = executor.submit(_build_and_warm, api_key)
+    executor.shutdown(wait=False)  # the worker exits once the build is done
+    return future
+
 def ensure_rag_index() -> bool:
     """Ensure RAG index exists, build if needed."""
-    try:
-        api_key = OPENAI_API_KEY
-        if not api_key:
-            st.error("❌ Missing `OPENAI_API_KEY`. Set it in Streamlit Secrets.")
-            return False
-
-        index_path = Path("data/rag")
-        index_path.mkdir(parents=True, exist_ok=True)
-        index_file = index_path / "index.faiss"
-        if index_file.exists():
-            st.sidebar.success("✅ Using existing knowledge base")
-            return True
-
-        with st.spinner("🔧 Building knowledge base (first time only)..."):
-            # Quick connectivity check (OpenAI Python SDK v1.x)
-            try:
-                from openai import OpenAI
-                client = OpenAI(api_key=api_key)
-                _ = client.models.list()
-            except Exception as e:
-                msg = str(e)
-                if "Incorrect API key" in msg:
-                    raise ValueError("The provided API key is invalid or has been revoked.")
-                elif "Rate limit" in msg:
-                    raise ValueError("API rate limit exceeded. Please try again later.")
-                else:
-                    raise ValueError(f"API connection failed: {msg}")
-
-            builder = RAGIndexBuilder(api_key=api_key)
-            st.sidebar.info("📚 Building knowledge base index...")
-            builder.build_index()
-
-            if index_file.exists():
-                st.sidebar.success("✅ Knowledge base built successfully")
-                return True
-            else:
-                raise RuntimeError("Failed to create knowledge base index file")
+    if st.session_state.get('rag_ready'):
+        return True
 
+    if not OPENAI_API_KEY:
+        st.error("❌ Missing `OPENAI_API_KEY`. Set it in Streamlit Secrets.")
+        return False
+
+    # Usually already finished: the build starts on first page load, while the form is filled in
+    future = _rag_build(OPENAI_API_KEY)
+    try:
+        if future.done():
+            status = future.result()
+        else:
+            with st.spinner("🔧 Building knowledge base (first time only)..."):
+                status = future.result()
     except Exception as e:
+        # Drop the failed build so the next attempt retries
+        _rag_build.clear()
         # Avoid leaking the API key in UI
         err = str(e).replace(OPENAI_API_KEY, f"{OPENAI_API_KEY[:4]}...{OPENAI_API_KEY[-4:]}")
         st.error(f"### ❌ Failed to Build Knowledge Base\n\n{err}")
         return False
 
+    # A toast rather than the sidebar: this runs inside the report fragment, which can't write outside itself
+    st.toast(status)
+    st.session_state.rag_ready = True
+    return True
+
 def render_patient_intake_form():
     """Render the main patient intake form"""
     st.header("📋 Patient Information")
@@ -139,9 +206,9 @@ def render_patient_intake_form():
 
         with col1:
             name = st.text_input("Full Name*", value=st.session_state.patient_data.get('name', ''))
-            dob = st.date_input("Date of Birth*", value=date(1980, 1, 1))
-            sex = st.selectbox("Sex*", ["Male", "Female", "Other"])
-            diabetes_type = st.selectbox("Diabetes Type*", ["T1DM", "T2DM"])
+            dob = st.date_input("Date of Birth*", value=DEFAULT_DOB)
+            sex = st.selectbox("Sex*", SEX_OPTIONS)
+            diabetes_type = st.selectbox("Diabetes Type*", DIABETES_TYPE_OPTIONS)
 
         with col2:
             height_cm = st.number_input("Height (cm)*", min_value=100, max_value=250, value=175)
@@ -149,46 +216,16 @@ def render_patient_intake_form():
             diagnosis_date = st.text_input("Year of Diagnosis", placeholder="e.g. 2015")
             ethnicity = st.text_input("Ethnicity", placeholder="Optional")
 
-        # Clinical Measurements
-        st.subheader("Current Vital Signs")
-        col3, col4, col5 = st.columns(3)
-
-        with col3:
-            bp_sys = st.number_input("Systolic BP (mmHg)", min_value=70, max_value=250, value=120)
-            bp_dia = st.number_input("Diastolic BP (mmHg)", min_value=40, max_value=150, value=80)
-
-        with col4:
-            heart_rate = st.number_input("Heart Rate (bpm)", min_value=40, max_value=200, value=72)
-            waist_cm = st.number_input("Waist Circumference (cm)", min_value=50, max_value=200, value=85)
-
-        with col5:
-            hypos_90d = st.number_input("Hypoglycemic episodes (last 90 days)", min_value=0, max_value=100, value=0)
-            severe_hypos_90d = st.number_input("Severe hypoglycemic episodes (last 90 days)", min_value=0, max_value=20, value=0)
-            dka_12m = st.number_input("DKA episodes (last 12 months)", min_value=0, max_value=10, value=0)
-
-        # Laboratory Values
-        st.subheader("Recent Laboratory Results")
-        col6, col7 = st.columns(2)
-
-        with col6:
-            hba1c_pct = st.number_input("HbA1c (%)", min_value=4.0, max_value=20.0, value=7.5, step=0.1)
-            fpg_mmol = st.number_input("Fasting Glucose (mmol/L)", min_value=2.0, max_value=30.0, value=5.5, step=0.1)
-            ppg2h_mmol = st.number_input("2h Post-meal Glucose (mmol/L)", min_value=3.0, max_value=40.0, value=8.0, step=0.1)
-
-        with col7:
-            st.write("**Lipid Profile**")
-            tc = st.number_input("Total Cholesterol (mmol/L)", min_value=2.0, max_value=15.0, value=5.0, step=0.1)
-            ldl = st.number_input("LDL Cholesterol (mmol/L)", min_value=1.0, max_value=10.0, value=2.5, step=0.1)
-            hdl = st.number_input("HDL Cholesterol (mmol/L)", min_value=0.5, max_value=3.0, value=1.2, step=0.1)
-            tg = st.number_input("Triglycerides (mmol/L)", min_value=0.5, max_value=20.0, value=1.5, step=0.1)
-
-        # Kidney function
-        col8, col9 = st.columns(2)
-        with col8:
-            egfr = st.number_input("eGFR (mL/min/1.73m²)", min_value=5, max_value=150, value=90)
-            creatinine_umol = st.number_input("Creatinine (μmol/L)", min_value=40, max_value=800, value=80)
-        with col9:
-            acr_mgmmol = st.number_input("ACR (mg/mmol)", min_value=0.0, max_value=100.0, value=2.0, step=0.1)
+        # Vitals, events and labs in a single editable grid
+        st.subheader("Vital Signs & Laboratory Results")
+        measurements = st.data_editor(
+            MEASUREMENTS_DF,
+            column_config=MEASUREMENT_COLUMN_CONFIG,
+            hide_index=True,
+            num_rows="fixed",
+            use_container_width=True,
+            key="measurements_editor"
+        )
 
         # Medications
         st.subheader("Current Medications")
@@ -203,11 +240,11 @@ def render_patient_intake_form():
         col10, col11 = st.columns(2)
         with col10:
             alcohol_units = st.number_input("Alcohol units per week", min_value=0, max_value=50, value=0)
-            smoking = st.selectbox("Smoking Status", ["Never", "Former", "Current"])
+            smoking = st.selectbox("Smoking Status", SMOKING_OPTIONS)
             sleep_hours = st.number_input("Average sleep hours per night", min_value=3, max_value=12, value=7)
         with col11:
-            activity_level = st.selectbox("Activity Level", ["Sedentary", "Light", "Moderate", "Very Active"])
-            diet_pattern = st.selectbox("Diet Pattern", ["Standard", "Low Carb", "Mediterranean", "Vegetarian", "Other"])
+            activity_level = st.selectbox("Activity Level", ACTIVITY_OPTIONS)
+            diet_pattern = st.selectbox("Diet Pattern", DIET_OPTIONS)
 
         # Goals
         goals = st.text_area("Patient Goals", placeholder="e.g. Improve HbA1c, reduce hypoglycemia, lose weight")
@@ -215,21 +252,20 @@ def render_patient_intake_form():
         # Submit
         submitted = st.form_submit_button("💾 Save Patient Data", type="primary")
         if submitted:
+            # Per-row ranges can't be expressed in column_config, so check them together here
+            values = measurements['Value']
+            out_of_range = values.isna() | ~values.between(MEASUREMENT_MIN, MEASUREMENT_MAX)
+            if out_of_range.any():
+                st.error("❌ Please correct: " + ", ".join(measurements.loc[out_of_range, 'Measurement']))
+                return
+            values = values.to_dict()
+
             # Parse medications
-            meds_list = []
-            if medications_text:
-                for line in medications_text.strip().split('\n'):
-                    if line.strip():
-                        parts = line.split(' - ')
-                        med_data = {
-                            'name': parts[0].strip(),
-                            'dose': parts[1].strip() if len(parts) > 1 else '',
-                            'schedule': '',
-                            'notes': ''
-                        }
-                        meds_list.append(med_data)
-
-            patient_data = {
+            meds_list = parse_medications(medications_text)
+
+            # Top-level fields are coerced by PatientIntake; labs and lifestyle are free-form
+            # dicts it leaves untouched, so only the integer-valued lab results are cast here
+            raw = {
                 'uuid': st.session_state.session_id,
                 'name': name,
                 'dob': dob.isoformat(),
@@ -237,49 +273,62 @@ def render_patient_intake_form():
                 'diabetes_type': diabetes_type,
                 'diagnosis_date': diagnosis_date or None,
                 'ethnicity': ethnicity or None,
-                'height_cm': float(height_cm),
-                'weight_kg': float(weight_kg),
-                'waist_cm': float(waist_cm) if waist_cm else None,
-                'bp_sys': float(bp_sys) if bp_sys else None,
-                'bp_dia': float(bp_dia) if bp_dia else None,
-                'heart_rate': float(heart_rate) if heart_rate else None,
-                'hypos_90d': int(hypos_90d),
-                'severe_hypos_90d': int(severe_hypos_90d),
-                'dka_12m': int(dka_12m),
+                'height_cm': height_cm,
+                'weight_kg': weight_kg,
+                'waist_cm': values['waist_cm'],
+                'bp_sys': values['bp_sys'],
+                'bp_dia': values['bp_dia'],
+                'heart_rate': values['heart_rate'],
+                'hypos_90d': values['hypos_90d'],
+                'severe_hypos_90d': values['severe_hypos_90d'],
+                'dka_12m': values['dka_12m'],
                 'meds': meds_list,
                 'lifestyle': {
-                    'alcohol_units': int(alcohol_units),
+                    'alcohol_units': alcohol_units,
                     'smoking': smoking,
-                    'sleep_hours': int(sleep_hours),
+                    'sleep_hours': sleep_hours,
                     'activity_level': activity_level,
                     'diet_pattern': diet_pattern
                 },
                 'labs': {
-                    'hba1c_pct': float(hba1c_pct),
-                    'fpg_mmol': float(fpg_mmol),
-                    'ppg2h_mmol': float(ppg2h_mmol),
-                    'egfr': int(egfr),
-                    'creatinine_umol': int(creatinine_umol),
-                    'acr_mgmmol': float(acr_mgmmol),
+                    'hba1c_pct': values['hba1c_pct'],
+                    'fpg_mmol': values['fpg_mmol'],
+                    'ppg2h_mmol': values['ppg2h_mmol'],
+                    'egfr': int(values['egfr']),
+                    'creatinine_umol': int(values['creatinine_umol']),
+                    'acr_mgmmol': values['acr_mgmmol'],
                     'lipids': {
-                        'tc': float(tc),
-                        'ldl': float(ldl),
-                        'hdl': float(hdl),
-                        'tg': float(tg)
+                        'tc': values['tc'],
+                        'ldl': values['ldl'],
+                        'hdl': values['hdl'],
+                        'tg': values['tg']
                     }
                 },
                 'goals': goals or None,
-                'devices': [],
-                'comorbidities': [],
-                'screenings': {},
-                'allergies': None,
-                'notes': None
             }
 
+            try:
+                patient_data = PatientIntake.model_validate(raw).model_dump()
+            except ValidationError as e:
+                st.error(f"❌ Invalid patient data: {e}")
+                return
+
             st.session_state.patient_data = patient_data
             st.success("✅ Patient data saved successfully!")
-            st.rerun()
 
+@st.cache_data(show_spinner=False)
+def _compute_conflicts(patient_data: dict, pdf_data: dict) -> list:
+    """Conflict rows, recomputed only when the form or PDF data actually changes."""
+    return find_conflicts(patient_data, pdf_data, pdf_data.get('_confidence', {}))
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def _parse_pdf(_pdf_bytes: bytes, pdf_hash: str, filename: str) -> dict:
+    """Parse an uploaded PDF once per unique content; keyed on its SHA-256 rather than hashing the bytes again."""
+    from agents.pdf_parser import PDFParser
+    # Cache a plain dict: pickled models break when Streamlit reloads the schema module
+    return PDFParser().parse_pdf(_pdf_bytes, filename=filename).model_dump()
+
+@st.fragment
 def render_pdf_import():
     """Render PDF import and conflict resolution"""
     st.header("📄 Lab Report Import (Optional)")
@@ -296,36 +345,37 @@ def render_pdf_import():
                 try:
                     # Lazy import so missing PyMuPDF doesn't crash the app
                     try:
-                        from agents.pdf_parser import PDFParser
+                        import agents.pdf_parser  # noqa: F401
                     except Exception as e:
-                        st.error(
-                            "PyMuPDF (fitz) is not available. "
-                            "Add `PyMuPDF==1.26.3` to requirements.txt and redeploy."
-                        )
+                        st.error(PYMUPDF_MISSING_MESSAGE)
                         return
 
-                    parser = PDFParser()
-                    extraction = parser.parse_pdf(uploaded_file)
+                    # Read the upload once; re-uploading the same file hits the cache
+                    pdf_bytes = uploaded_file.getvalue()
+                    pdf_hash = hashlib.sha256(pdf_bytes).hexdigest()
+                    extraction = PDFExtraction(**_parse_pdf(pdf_bytes, pdf_hash, uploaded_file.name))
 
                     if getattr(extraction, "warnings", None):
                         for warning in extraction.warnings:
                             st.warning(f"⚠️ {warning}")
 
-                    if getattr(extraction, "confidence", 0) > 0.1:
-                        st.success(f"✅ PDF processed (confidence: {extraction.confidence:.1%})")
-                        st.session_state.pdf_data = {
-                            **getattr(extraction, "labs", {}),
-                            **getattr(extraction, "vitals", {}),
-                            '_confidence': {k: extraction.confidence for k in {**getattr(extraction, "labs", {}), **getattr(extraction, "vitals", {})}}
-                        }
+                    confidence = getattr(extraction, "confidence", 0)
+                    if confidence > 0.1:
+                        st.success(f"✅ PDF processed (confidence: {confidence:.1%})")
+                        labs = getattr(extraction, "labs", {}) or {}
+                        vitals = getattr(extraction, "vitals", {}) or {}
+                        # Build in place: one copy of labs, vitals merged in, then the confidence map
+                        pdf_data = dict(labs)
+                        pdf_data.update(vitals)
+                        pdf_data['_confidence'] = dict.fromkeys(pdf_data, confidence)
+                        st.session_state.pdf_data = pdf_data
                         with st.expander("📊 Extracted Data", expanded=True):
-                            if extraction.labs:
+                            if labs:
                                 st.write("**Laboratory Values:**")
-                                st.json(extraction.labs)
-                            if extraction.vitals:
+                                st.json(labs)
+                            if vitals:
                                 st.write("**Vital Signs:**")
-                                st.json(extraction.vitals)
-                        st.rerun()
+                                st.json(vitals)
                     else:
                         st.error("❌ Could not extract meaningful data from PDF")
 
@@ -333,13 +383,78 @@ def render_pdf_import():
                     st.error(f"PDF processing failed: {str(e)}")
 
     # Show conflict resolution if needed
-    if st.session_state.pdf_data and st.session_state.patient_data:
+    pdf_data = st.session_state.pdf_data
+    patient_data = st.session_state.patient_data
+    if pdf_data and patient_data:
         st.session_state.conflicts = create_conflict_resolver(
-            st.session_state.patient_data,
-            st.session_state.pdf_data,
-            st.session_state.pdf_data.get('_confidence', {})
+            patient_data,
+            pdf_data,
+            pdf_data.get('_confidence', {}),
+            conflict_data=_compute_conflicts(patient_data, pdf_data)
         )
 
+@st.cache_data(show_spinner=False)
+def _snapshot(patient_data: dict, _rules_dict: dict) -> dict:
+    """Clinical snapshot, recomputed only when patient data changes (rules are a process-wide constant)."""
+    return create_clinical_snapshot(patient_data, _rules_dict)
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _render_text(report_dict: dict, patient_dict: dict, _rules_dict: dict) -> str:
+    """Plain-text report, formatted once per unique report (rules are a process-wide constant)."""
+    return render_text_report(report_dict, patient_dict, _rules_dict)
+
+class ReportGenerationFailed(Exception):
+    """Raised out of _cached_generate so failed generations are not cached."""
+
+    def __init__(self, errors: list):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _cached_generate(intake_hash: str, _merged_data, nonce: str = "", _use_cache: bool = True) -> tuple:
+    """
+    Generate a report once per unique intake; returns (report dict, errors, reused from a similar intake).
+    A fresh nonce with _use_cache=False regenerates for one session without evicting anyone else's entry.
+    """
+    # Lookup order: this process (st.cache_data), the on-disk store, similar intakes, then the LLM
+    store = get_report_store()
+    if _use_cache:
+        try:
+            stored = store.get(intake_hash)
+        except Exception as e:
+            print(f"Report store lookup failed: {str(e)}")
+            stored = None
+        if stored is not None:
+            return stored, [], False
+
+    intake = _merged_data.model_dump()
+    semantic_cache = get_semantic_cache() if SEMANTIC_REPORT_CACHE else None
+    if semantic_cache is not None and _use_cache:
+        try:
+            cached = semantic_cache.lookup(intake)
+        except Exception as e:
+            print(f"Semantic cache lookup failed: {str(e)}")
+            cached = None
+        if cached is not None:
+            return cached, [], True
+
+    report, errors = get_orchestrator().generate_report(_merged_data, use_cache=_use_cache)
+    if report is None:
+        raise ReportGenerationFailed(errors)
+
+    report_dict = report.model_dump()
+    try:
+        store.set(intake_hash, report_dict)
+    except Exception as e:
+        print(f"Report store update failed: {str(e)}")
+    if semantic_cache is not None:
+        try:
+            semantic_cache.add(intake, report_dict)
+        except Exception as e:
+            print(f"Semantic cache update failed: {str(e)}")
+    return report_dict, errors, False
+
+@st.fragment
 def render_report_generation():
     """Render report generation section"""
     st.header("🤖 Generate AI Report")
@@ -354,12 +469,16 @@ def render_report_generation():
         display_validation_warnings(warnings)
 
     # Clinical snapshot cards
-    rules = load_rules()
-    create_clinical_snapshot_cards(st.session_state.patient_data, rules)
+    rules = _rules()
+    create_clinical_snapshot_cards(
+        st.session_state.patient_data, rules,
+        snapshot=_snapshot(st.session_state.patient_data, rules)
+    )
 
     # Generate report button
     col1, col2, col3 = st.columns([1, 2, 1])
     with col2:
+        force_regenerate = st.checkbox("Force regenerate", help="Ignore any cached report for identical patient data")
         if st.button("🚀 Generate Consultant Report", type="primary", use_container_width=True):
 
             if not ensure_rag_index():
@@ -371,7 +490,7 @@ def render_report_generation():
 
             with st.spinner("🧠 Generating AI report with clinical evidence..."):
                 try:
-                    orchestrator = ReportOrchestrator()
+                    orchestrator = get_orchestrator()
 
                     # Merge data sources
                     create_progress_tracker("Processing PDF")
@@ -381,22 +500,36 @@ def render_report_generation():
                         st.session_state.conflicts
                     )
 
-                    # Generate report
+                    # Generate report, reusing the last result for identical intake data
                     create_progress_tracker("Generating Report")
-                    report, errors = orchestrator.generate_report(merged_data)
+                    intake_json = orjson.dumps(merged_data.model_dump(), option=orjson.OPT_SORT_KEYS, default=str)
+                    intake_hash = hashlib.blake2b(intake_json, digest_size=16).hexdigest()
+                    if force_regenerate:
+                        st.session_state.report_nonce = uuid.uuid4().hex
+                    try:
+                        report_dict, errors, reused = _cached_generate(
+                            intake_hash, merged_data, st.session_state.report_nonce, not force_regenerate
+                        )
+                        report = ReportOut(**report_dict)
+                    except ReportGenerationFailed as e:
+                        report, errors, reused = None, e.errors, False
 
                     if report:
                         create_progress_tracker("Finalizing")
 
                         st.session_state.generated_report = report
-                        st.session_state.report_text = render_text_report(
-                            report.dict(),
-                            merged_data.dict(),
-                            rules
+                        st.session_state.generated_report_dict = report_dict
+                        st.session_state.report_reused = reused
+                        st.session_state.pdf_future = None
+                        st.session_state.pdf_bytes = None
+                        st.session_state.pdf_error = None
+                        # Keep the inputs, not the text: it's re-rendered from the cache on download
+                        st.session_state.report_patient_dict = merged_data.model_dump()
+
+                        save_dir = orchestrator.save_report(
+                            merged_data.uuid, report, merged_data, report_dict=report_dict
                         )
 
-                        save_dir = orchestrator.save_report(merged_data.uuid, report, merged_data)
-
                         st.success("✅ Report generated successfully!")
                         st.info(f"📁 Saved to: {save_dir}")
                         st.rerun()
@@ -409,6 +542,30 @@ def render_report_generation():
                     st.error(f"Report generation failed: {str(e)}")
                     st.exception(e)
 
+@st.cache_resource
+def _pdf_pool() -> ThreadPoolExecutor:
+    """Shared worker for PDF rendering; PDFGenerator serializes builds, so more threads would only queue on its lock."""
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="pdf")
+
+@st.fragment(run_every=1)
+def _poll_pdf_job():
+    """Poll the background PDF job; once it's done, keep the bytes and stop polling."""
+    future = st.session_state.pdf_future
+    if future is None:
+        return
+    if not future.done():
+        st.info("🔄 Creating PDF...")
+        return
+
+    st.session_state.pdf_future = None
+    try:
+        st.session_state.pdf_bytes = future.result()
+    except Exception as e:
+        st.session_state.pdf_error = f"PDF generation failed: {str(e)}"
+    # Full rerun: this fragment is no longer rendered, so the polling stops
+    st.rerun()
+
+@st.fragment
 def render_report_display():
     """Render the generated report"""
     if not st.session_state.generated_report:
@@ -416,11 +573,18 @@ def render_report_display():
 
     st.header("📊 Generated Report")
 
-    create_report_tabs(
-        st.session_state.generated_report.dict(),
-        st.session_state.patient_data,
-        load_rules()
-    )
+    if st.session_state.report_reused:
+        st.warning(
+            "⚠️ This report was reused from an earlier intake for this patient whose clinical values "
+            "matched within tolerance. Tick \"Force regenerate\" to build one from the current data."
+        )
+
+    # Read once per render; the tabs, downloads and PDF job all share these
+    rules = _rules()
+    report_dict = st.session_state.generated_report_dict
+    patient = st.session_state.patient_data
+
+    create_report_tabs(report_dict, patient, rules)
 
     st.markdown("---")
     st.subheader("📥 Download Options")
@@ -428,10 +592,10 @@ def render_report_display():
     col1, col2 = st.columns(2)
 
     with col1:
-        if st.session_state.report_text:
+        if st.session_state.report_patient_dict:
             st.download_button(
                 label="📄 Download Text Report",
-                data=st.session_state.report_text,
+                data=_render_text(report_dict, st.session_state.report_patient_dict, rules),
                 file_name=f"diabetes_report_{datetime.now().strftime('%Y%m%d')}.txt",
                 mime="text/plain",
                 use_container_width=True
@@ -439,34 +603,54 @@ def render_report_display():
 
     with col2:
         if st.button("📄 Generate PDF", use_container_width=True):
-            with st.spinner("🔄 Creating PDF..."):
-                try:
-                    pdf_generator = PDFGenerator()
-                    pdf_content = pdf_generator.generate_pdf_report(
-                        st.session_state.patient_data,
-                        st.session_state.generated_report.dict(),
-                        load_rules()
-                    )
-
-                    st.download_button(
-                        label="💾 Download PDF Report",
-                        data=pdf_content,
-                        file_name=f"diabetes_report_{datetime.now().strftime('%Y%m%d')}.pdf",
-                        mime="application/pdf",
-                        use_container_width=True
-                    )
+            # Render off the script thread so this session (and others) stay responsive
+            st.session_state.pdf_bytes = None
+            st.session_state.pdf_error = None
+            st.session_state.pdf_future = _pdf_pool().submit(
+                get_pdf_generator().generate_pdf_report,
+                patient,
+                report_dict,
+                rules
+            )
 
-                except Exception as e:
-                    st.error(f"PDF generation failed: {str(e)}")
+        if st.session_state.pdf_future is not None:
+            _poll_pdf_job()
+        elif st.session_state.pdf_error:
+            st.error(st.session_state.pdf_error)
+        elif st.session_state.pdf_bytes is not None:
+            st.download_button(
+                label="💾 Download PDF Report",
+                data=st.session_state.pdf_bytes,
+                file_name=f"diabetes_report_{datetime.now().strftime('%Y%m%d')}.pdf",
+                mime="application/pdf",
+                use_container_width=True
+            )
 
 def main():
     """Main application"""
 
     # Header
-    st.title("🩺 Diabetes Consultant AI Assistant")
-    st.markdown("### Schema-Locked Single-Pass Clinical Report Generator")
+    st.title(APP_TITLE)
+    st.markdown(APP_SUBTITLE)
+
+    # Check/build the knowledge base in the background so it's ready by report time
+    if OPENAI_API_KEY:
+        _rag_build(OPENAI_API_KEY)
+
+    # Main content
+    tab1, tab2, tab3 = st.tabs(["📋 Patient Intake", "📄 PDF Import", "📊 Generate Report"])
+
+    with tab1:
+        render_patient_intake_form()
 
-    # Sidebar navigation
+    with tab2:
+        render_pdf_import()
+
+    with tab3:
+        render_report_generation()
+        render_report_display()
+
+    # Sidebar navigation, drawn after the tabs so progress reflects this run's form submit
     with st.sidebar:
         st.header("Navigation")
         st.info(f"Session: {st.session_state.session_id[:8]}...")
@@ -479,31 +663,19 @@ def main():
             st.write(step)
 
         if st.button("🔄 Start New Report"):
-            for key in ['patient_data', 'pdf_data', 'conflicts', 'generated_report', 'report_text']:
-                if key in st.session_state:
-                    del st.session_state[key]
+            st.session_state.update(SESSION_DEFAULTS)
             st.rerun()
 
-    # Main content
-    tab1, tab2, tab3 = st.tabs(["📋 Patient Intake", "📄 PDF Import", "📊 Generate Report"])
-
-    with tab1:
-        render_patient_intake_form()
-
-    with tab2:
-        render_pdf_import()
-
-    with tab3:
-        render_report_generation()
-        render_report_display()
+        if st.button("🔁 Reload Knowledge Base", help="Re-check the RAG index, e.g. after rebuilding it on disk"):
+            # The orchestrator holds the loaded FAISS index, so it has to go too
+            _rag_build.clear()
+            get_orchestrator.clear()
+            st.session_state.rag_ready = False
+            st.rerun()
 
     # Footer
     st.markdown("---")
-    st.markdown(
-        "🔬 **Powered by:** NICE/BDA Guidelines • "
-        "🏥 **For:**  Digital Health • "
-        f"⚡ **Built:** {datetime.now().strftime('%Y')}"
-    )
+    st.markdown(FOOTER)
 
 if __name__ == "__main__":
     main()
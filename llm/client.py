@@ -0,0 +1,165 @@
+"""
+Shared OpenAI client helpers for diabetes report system
+"""
+import asyncio
+import re
+import threading
+import time
+import weakref
+from functools import lru_cache
+from typing import Dict, Type
+import httpx
+import json5
+import orjson
+from openai import (
+    APIConnectionError, APITimeoutError, DefaultHttpxClient, InternalServerError, OpenAI, RateLimitError
+)
+from pydantic import BaseModel
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+
+try:
+    import tiktoken
+except ImportError:  # fall back to a character-based estimate
+    tiktoken = None
+
+# Cap on in-flight OpenAI requests across all async callers
+MAX_CONCURRENT_REQUESTS = 8
+
+@lru_cache(maxsize=None)
+def get_openai_client(api_key: str) -> OpenAI:
+    """Get the process-wide OpenAI client for an API key, reusing its connection pool"""
+    # Retries are handled by llm_retry rather than the SDK
+    return OpenAI(
+        api_key=api_key,
+        max_retries=0,
+        http_client=DefaultHttpxClient(limits=httpx.Limits(max_connections=100, max_keepalive_connections=20))
+    )
+
+# asyncio primitives are bound to the loop they first wait on, and callers may
+# run each batch under a fresh asyncio.run() loop, so keep one semaphore per loop.
+_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+def get_request_semaphore() -> asyncio.Semaphore:
+    """Get the request-limiting semaphore for the running event loop"""
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        _semaphores[loop] = semaphore
+    return semaphore
+
+# Transient transport/server errors worth retrying; anything else fails fast
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+MAX_RETRY_WAIT = 30
+
+_backoff = wait_random_exponential(multiplier=1, max=MAX_RETRY_WAIT)
+
+def wait_retry_after(retry_state) -> float:
+    """Honour the server's retry-after header, otherwise back off exponentially with jitter"""
+    response = getattr(retry_state.outcome.exception(), 'response', None)
+    if response is not None:
+        try:
+            return min(float(response.headers.get('retry-after')), MAX_RETRY_WAIT)
+        except (TypeError, ValueError):
+            pass
+    return _backoff(retry_state)
+
+# Works on both sync and async callables
+llm_retry = retry(
+    retry=retry_if_exception_type(RETRYABLE_ERRORS),
+    wait=wait_retry_after,
+    stop=stop_after_attempt(5),
+    reraise=True
+)
+
+@lru_cache(maxsize=None)
+def get_token_encoding(model: str):
+    """Get the tiktoken encoding for a model, or None if tiktoken isn't installed"""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+def estimate_tokens(text: str, model: str = "gpt-4o-mini") -> int:
+    """Estimate the prompt tokens for text, before dispatching a request"""
+    try:
+        encoding = get_token_encoding(model)
+        if encoding is not None:
+            return len(encoding.encode(text))
+    except Exception:
+        pass
+    # Roughly 4 characters per token for English text
+    return len(text) // 4 + 1
+
+class RateLimiter:
+    """Token bucket keeping requests under OpenAI's tokens- and requests-per-minute limits"""
+    
+    def __init__(self, tokens_per_minute: int, requests_per_minute: int):
+        self.tokens_per_minute = tokens_per_minute
+        self.requests_per_minute = requests_per_minute
+        self._tokens = float(tokens_per_minute)
+        self._requests = float(requests_per_minute)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def _try_acquire(self, tokens: int) -> float:
+        """Take capacity for one request if available; otherwise return seconds to wait"""
+        # A request larger than the whole budget could never fit, so cap it
+        tokens = min(tokens, self.tokens_per_minute)
+        
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._updated
+            self._updated = now
+            self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+            self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+            
+            if self._tokens >= tokens and self._requests >= 1:
+                self._tokens -= tokens
+                self._requests -= 1
+                return 0.0
+            
+            return max(
+                (tokens - self._tokens) * 60 / self.tokens_per_minute,
+                (1 - self._requests) * 60 / self.requests_per_minute
+            )
+    
+    def acquire(self, tokens: int):
+        """Block until a request of the given size may be sent"""
+        while (delay := self._try_acquire(tokens)) > 0:
+            time.sleep(delay)
+    
+    async def aacquire(self, tokens: int):
+        """Wait without blocking the event loop until a request may be sent"""
+        while (delay := self._try_acquire(tokens)) > 0:
+            await asyncio.sleep(delay)
+
+@lru_cache(maxsize=None)
+def get_rate_limiter(tokens_per_minute: int, requests_per_minute: int) -> RateLimiter:
+    """Get the process-wide limiter for an account tier (limits are per API key, not per client)"""
+    return RateLimiter(tokens_per_minute, requests_per_minute)
+
+# A fenced ```json block anywhere in the reply, or an unterminated opening fence
+_JSON_FENCE = re.compile(r"```(?:json)?\s*(.*?)\s*```", re.IGNORECASE | re.DOTALL)
+_OPEN_FENCE = re.compile(r"^```(?:json)?\s*", re.IGNORECASE)
+
+def parse_json_response(text: str):
+    """Parse a model's JSON reply, tolerating code fences and minor syntax slips"""
+    match = _JSON_FENCE.search(text)
+    payload = match.group(1) if match else _OPEN_FENCE.sub("", text.strip())
+    
+    try:
+        return orjson.loads(payload)
+    except orjson.JSONDecodeError:
+        # Trailing commas and similar slips would otherwise cost a full retry
+        return json5.loads(payload)
+
+def json_schema_format(model: Type[BaseModel], name: str) -> Dict:
+    """Build a json_schema response_format from a Pydantic model"""
+    # Not strict: strict mode needs closed objects, and the free-form Dict fields are open
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": name, "schema": model.model_json_schema(), "strict": False}
+    }
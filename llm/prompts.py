@@ -25,12 +25,12 @@ def get_report_generation_prompt() -> str:
 
 You receive:
 1) patient_intake (JSON),
-2) rules (JSON thresholds),
+2) rules (thresholds, one per line, numbered R1..Rn),
 3) retrieved_snippets (array of {id, source, section, text})
 
-TASK: produce ONE valid JSON of type ReportOut. Every recommendation must include >=1 citation_ids that map to retrieved_snippets[]. Do NOT invent facts. Use rules for targets and traffic-light. Round all values sensibly (HbA1c 1 dp; mmol/L 1 dp; BP ints).
+TASK: produce ONE valid JSON of type ReportOut. Every recommendation must include >=1 citation_ids that map to retrieved_snippets[]. Do NOT invent facts. Use rules for targets and traffic-light; refer to a rule by its R<n> id instead of quoting it (R<n> ids are never citation_ids). Round all values sensibly (HbA1c 1 dp; mmol/L 1 dp; BP ints).
 
-Required sections (non-empty): executive_summary, snapshot, clinical_context, labs_table, interpretation, lifestyle_plan, diet_plan, monitoring_plan, screening_tracker, patient_goals, medication_plan, follow_up, emr_note, citations.
+Every section in the response schema is required and must be non-empty.
 
 Format guidelines:
 - executive_summary: 2-3 sentences summarizing key clinical status and priorities
@@ -38,13 +38,11 @@ Format guidelines:
 - clinical_context: {current_therapy, devices, complications, recent_events}
 - labs_table: [{test, value, target, status, comment}] - include all available labs
 - interpretation: [{problem, assessment, plan, citation_ids}] - clinical reasoning
-- lifestyle_plan: [{text, citation_ids}] - specific lifestyle recommendations
 - diet_plan: {principles, sample_meals, portion_guidance, citation_ids}
 - monitoring_plan: {glucose_targets, testing_frequency, safety_checks, citation_ids}
 - screening_tracker: [{domain, last_date, result, next_due, status}] - annual checks
-- patient_goals: [list of specific, measurable goals]
-- medication_plan: [{text, citation_ids}] - medication recommendations
 - follow_up: [{when, actions}] - follow-up schedule
+- patient_goals: specific and measurable
 - emr_note: concise clinical note for medical records
 - citations: [{id, source, section}] - all referenced sources
 
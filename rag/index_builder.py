@@ -3,12 +3,30 @@ RAG index builder for NICE/BDA guidelines
 """
 import os
 import json
+import re
 import numpy as np
 import faiss
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict
 from pathlib import Path
 import openai
-from openai import OpenAI
+from llm.client import estimate_tokens, get_openai_client, get_token_encoding, llm_retry
+from rag.local_embeddings import LOCAL_EMBEDDING_MODEL, embed_locally, get_local_embedder, use_local_embeddings
+from utils.cache import DiskCache, EmbeddingStore
+
+_WORD = re.compile(r"\S+")
+
+# Embedding requests in flight at once during a build
+MAX_EMBEDDING_WORKERS = 5
+
+# Index type by corpus size: flat scan while it's cheap, then HNSW graph, then IVF
+FLAT_INDEX_MAX = 1_000
+HNSW_INDEX_MAX = 10_000
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 100
+
+# Share of the local model's max_seq_length a chunk may fill, measured in tiktoken tokens
+LOCAL_CHUNK_FRACTION = 0.75
 
 class RAGIndexBuilder:
     """Build and manage FAISS index for diabetes guidelines"""
@@ -24,26 +42,23 @@ class RAGIndexBuilder:
             if not (self.api_key.startswith('sk-') or self.api_key.startswith('sk-proj-')):
                 raise ValueError("Invalid API key format. It should start with 'sk-' or 'sk-proj-'")
             
-            # Initialize OpenAI client
-            self.client = OpenAI(api_key=self.api_key)
-            
-            # Test the API key with a simple request
-            try:
-                models = self.client.models.list()
-                if not models.data:
-                    raise ValueError("API key is invalid or has no access to models")
-            except Exception as e:
-                if "Incorrect API key" in str(e):
-                    raise ValueError("The provided API key is invalid or revoked.")
-                elif "Rate limit" in str(e):
-                    raise ValueError("API rate limit exceeded. Please try again later.")
-                else:
-                    raise ValueError(f"Failed to verify API key: {str(e)}")
+            # Initialize OpenAI client; the key itself is verified by the first embedding request
+            self.client = get_openai_client(self.api_key)
+            self._verified = False
             
             # Set embedding model
-            self.embedding_model = os.getenv('EMBEDDING_MODEL', 'text-embedding-ada-002')
-            self.chunk_size = 1000
-            self.overlap = 200
+            self.local = use_local_embeddings()
+            # Chunk sizes are in tokens (words if no tokenizer is available)
+            if self.local:
+                self.embedding_model = LOCAL_EMBEDDING_MODEL
+                # The local model silently truncates past max_seq_length of its own tokens;
+                # chunks are counted with tiktoken, so leave room for the two disagreeing
+                self.chunk_size = min(1000, int(get_local_embedder().max_seq_length * LOCAL_CHUNK_FRACTION))
+            else:
+                self.embedding_model = os.getenv('EMBEDDING_MODEL', 'text-embedding-ada-002')
+                # Well under the 8191-token OpenAI input limit
+                self.chunk_size = 1000
+            self.overlap = self.chunk_size // 5
             
             # Log successful initialization (without exposing the key)
             print("✅ Successfully initialized OpenAI client")
@@ -98,23 +113,132 @@ class RAGIndexBuilder:
         return guidelines
         
     def chunk_text(self, text: str) -> List[str]:
-        """Split text into overlapping chunks"""
-        words = text.split()
+        """Split text into overlapping chunks of chunk_size tokens, as the embedding model counts them"""
+        try:
+            encoding = get_token_encoding(self.embedding_model)
+        except Exception as e:
+            # tiktoken fetches its vocabularies on first use, which can fail offline
+            print(f"⚠️ Tokenizer unavailable, chunking by words: {str(e)}")
+            encoding = None
+        if encoding is None:
+            return self._chunk_words(text)
+        
+        # Encode once; each chunk is decoded from its own slice of token ids
+        ids = encoding.encode(text)
+        return [
+            encoding.decode(ids[i:i + self.chunk_size])
+            for i in range(0, len(ids), self.chunk_size - self.overlap)
+        ]
+    
+    def _chunk_words(self, text: str) -> List[str]:
+        """Split text into overlapping chunks of chunk_size words"""
+        # Word boundaries as character offsets; chunks are slices of the original text
+        offsets = [(m.start(), m.end()) for m in _WORD.finditer(text)]
         chunks = []
         
-        for i in range(0, len(words), self.chunk_size - self.overlap):
-            chunk_words = words[i:i + self.chunk_size]
-            chunks.append(' '.join(chunk_words))
+        for i in range(0, len(offsets), self.chunk_size - self.overlap):
+            last = min(i + self.chunk_size, len(offsets)) - 1
+            chunks.append(text[offsets[i][0]:offsets[last][1]])
             
         return chunks
     
-    def get_embeddings(self, texts: List[str]) -> np.ndarray:
-        """Get embeddings for text chunks"""
-        response = self.client.embeddings.create(
-            model=self.embedding_model,
-            input=texts
+    def get_embeddings(self, texts: List[str], max_batch: int = 96,
+                       max_batch_tokens: int = 250_000) -> np.ndarray:
+        """Get float32 embeddings for text chunks, in length-sorted micro-batches sent concurrently"""
+        if not texts:
+            return np.empty((0, 0), dtype='float32')
+        
+        # Sorting by length groups similar-sized inputs, so batches fill the token budget evenly
+        order = np.argsort([len(text) for text in texts], kind='stable')
+        batches, batch, batch_tokens = [], [], 0
+        for i in order:
+            tokens = estimate_tokens(texts[i], self.embedding_model)
+            if batch and (len(batch) == max_batch or batch_tokens + tokens > max_batch_tokens):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(i)
+            batch_tokens += tokens
+        batches.append(batch)
+        
+        def embed(batch):
+            return self._embed_batch([texts[i] for i in batch])
+        
+        results = []
+        if not self._verified:
+            # Send the first batch alone: it doubles as the API key check, so a bad key fails once
+            results.append(self._verify_key(embed, batches[0]))
+        with ThreadPoolExecutor(max_workers=MAX_EMBEDDING_WORKERS) as pool:
+            results.extend(pool.map(embed, batches[len(results):]))
+        
+        # Scatter each batch back to its original positions
+        embeddings = np.empty((len(texts), results[0].shape[1]), dtype='float32')
+        for batch, vectors in zip(batches, results):
+            embeddings[batch] = vectors
+        return embeddings
+    
+    def get_cached_embeddings(self, texts: List[str], store: EmbeddingStore) -> np.ndarray:
+        """Get normalized embeddings, calling the API only for texts not already in the store"""
+        keys = [DiskCache.make_key(self.embedding_model, text) for text in texts]
+        cached = [store.get(key) for key in keys]
+        missing = [i for i, blob in enumerate(cached) if blob is None]
+        print(f"♻️ Reusing {len(texts) - len(missing)} cached embeddings")
+        
+        fresh = None
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            fresh = embed_locally(missing_texts) if self.local else self.get_embeddings(missing_texts)
+            # Stored normalized, matching what RAGRetriever writes to the same store
+            faiss.normalize_L2(fresh)
+            store.set_many((keys[i], row.tobytes()) for i, row in zip(missing, fresh))
+        
+        dimension = fresh.shape[1] if fresh is not None else len(cached[0]) // 4
+        embeddings = np.empty((len(texts), dimension), dtype='float32')
+        for i, blob in enumerate(cached):
+            if blob is not None:
+                embeddings[i] = np.frombuffer(blob, dtype='float32')
+        if missing:
+            embeddings[missing] = fresh
+        return embeddings
+    
+    def _verify_key(self, embed, batch) -> np.ndarray:
+        """Run the first embedding request, translating key and quota failures"""
+        try:
+            vectors = embed(batch)
+        except Exception as e:
+            if "Incorrect API key" in str(e):
+                raise ValueError("The provided API key is invalid or revoked.")
+            elif "Rate limit" in str(e):
+                raise ValueError("API rate limit exceeded. Please try again later.")
+            raise
+        self._verified = True
+        return vectors
+    
+    @llm_retry
+    def _embed_batch(self, batch: List[str]) -> np.ndarray:
+        """Embed one micro-batch, retrying rate limits and transient errors"""
+        response = self.client.embeddings.create(model=self.embedding_model, input=batch)
+        return np.array([emb.embedding for emb in response.data], dtype='float32')
+    
+    def create_index(self, embeddings: np.ndarray) -> faiss.Index:
+        """Create an inner-product index sized to the corpus, storing vectors as 8-bit scalars"""
+        count, dimension = embeddings.shape
+        # int8 codes are a quarter of float32's bytes to scan, with negligible recall loss at this dimension
+        sq8 = faiss.ScalarQuantizer.QT_8bit
+        
+        if count <= FLAT_INDEX_MAX:
+            # A brute-force scan this small beats graph traversal
+            return faiss.IndexScalarQuantizer(dimension, sq8, faiss.METRIC_INNER_PRODUCT)
+        
+        if count <= HNSW_INDEX_MAX:
+            index = faiss.IndexHNSWSQ(dimension, sq8, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+            return index
+        
+        quantizer = faiss.IndexFlatIP(dimension)
+        index = faiss.IndexIVFScalarQuantizer(
+            quantizer, dimension, int(4 * np.sqrt(count)), sq8, faiss.METRIC_INNER_PRODUCT
         )
-        return np.array([emb.embedding for emb in response.data])
+        return index
     
     def build_index(self, save_path: str = "data/rag"):
         """Build FAISS index from guidelines with proper vector normalization"""
@@ -144,25 +268,21 @@ class RAGIndexBuilder:
             
             # Generate embeddings
             print(f"🔄 Generating embeddings for {len(all_chunks)} text chunks...")
-            embeddings = self.get_embeddings(all_chunks)
-            
-            # Convert to numpy array and ensure float32
-            import numpy as np
-            embeddings = np.array(embeddings).astype('float32')
-            
-            # Normalize vectors to unit length (L2 norm)
-            print("📏 Normalizing vectors...")
-            faiss.normalize_L2(embeddings)
+            embeddings = self.get_cached_embeddings(all_chunks, EmbeddingStore())
             
+            # Already unit length (normalized in place as they were embedded), C-contiguous float32
             # Get vector dimension
             dimension = embeddings.shape[1]
             print(f"🔢 Vector dimension: {dimension}")
             
             # Create FAISS index with inner product (cosine) similarity
             print("🏗️ Creating FAISS index...")
-            index = faiss.IndexFlatIP(dimension)  # Inner product for cosine similarity
+            index = self.create_index(embeddings)
+            if not index.is_trained:
+                # Learns the per-dimension ranges for the 8-bit codes (and IVF centroids)
+                index.train(embeddings)
             
-            # Add vectors to index
+            # Add all vectors in one call rather than per batch
             print("📥 Adding vectors to index...")
             index.add(embeddings)
             
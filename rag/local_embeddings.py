@@ -0,0 +1,31 @@
+"""
+Local sentence-transformers embeddings, selected with EMBED_BACKEND=local
+"""
+import os
+from functools import lru_cache
+from typing import List
+import numpy as np
+
+LOCAL_EMBEDDING_MODEL = "BAAI/bge-small-en-v1.5"
+
+def use_local_embeddings() -> bool:
+    """Whether EMBED_BACKEND selects the local model over the OpenAI API"""
+    return os.getenv('EMBED_BACKEND', 'openai').lower() == 'local'
+
+@lru_cache(maxsize=1)
+def get_local_embedder():
+    """Load the local embedding model once per process"""
+    # Imported lazily: torch is heavy and only needed for this backend
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(LOCAL_EMBEDDING_MODEL)
+
+def embed_locally(texts: List[str]) -> np.ndarray:
+    """Embed texts as L2-normalized float32 rows"""
+    embeddings = get_local_embedder().encode(
+        texts,
+        batch_size=64,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+        show_progress_bar=False
+    )
+    return embeddings.astype('float32', copy=False)
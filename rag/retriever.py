@@ -5,19 +5,42 @@ import os
 import json
 import numpy as np
 import faiss
+from functools import lru_cache
 from typing import List, Dict, Optional
 from pathlib import Path
 import openai
-from openai import OpenAI
+from llm.client import get_openai_client, llm_retry
+from rag.local_embeddings import LOCAL_EMBEDDING_MODEL, embed_locally, use_local_embeddings
+from utils.cache import DiskCache, EmbeddingStore
+
+# Canonical queries used to warm the index and embedding connection at startup
+WARMUP_QUERIES = (
+    "HbA1c target for T2DM",
+    "hypoglycemia management",
+    "metformin contraindications",
+    "NICE CKD screening",
+    "DKA prevention",
+)
+
+# Search breadth for graph (HNSW) and inverted-file (IVF) indexes
+HNSW_EF_SEARCH = 64
+IVF_NPROBE = 16
 
 class RAGRetriever:
     """Retrieve relevant guidelines from FAISS index"""
     
     def __init__(self, index_path: str = "data/rag", api_key: str = None):
-        self.client = OpenAI(api_key=api_key or os.getenv('OPENAI_API_KEY'))
-        self.embedding_model = "text-embedding-ada-002"
+        api_key = api_key or os.getenv('OPENAI_API_KEY')
+        self.client = get_openai_client(api_key)
+        # Must match the backend the index was built with
+        self.local = use_local_embeddings()
+        self.embedding_model = LOCAL_EMBEDDING_MODEL if self.local else "text-embedding-ada-002"
         self.index_path = Path(index_path)
         
+        # Queries are built from a handful of patient flags, so the same strings recur
+        self.embedding_store = EmbeddingStore()
+        self._embed = lru_cache(maxsize=1024)(self._embed_query)
+        
         # Load index and metadata
         self.index = None
         self.metadata = []
@@ -32,23 +55,79 @@ class RAGRetriever:
             print("Index not found. Please run index_builder.py first.")
             return
             
-        self.index = faiss.read_index(str(index_file))
+        try:
+            # Map the vector codes rather than copying them, so worker processes share the OS page cache
+            self.index = faiss.read_index(str(index_file), self._mmap_flags(index_file))
+        except RuntimeError as e:
+            print(f"Memory-mapping the index failed, loading it instead: {str(e)}")
+            self.index = faiss.read_index(str(index_file))
+        
+        # Search-time accuracy knobs aren't persisted with the index
+        if hasattr(self.index, 'hnsw'):
+            self.index.hnsw.efSearch = HNSW_EF_SEARCH
+        elif hasattr(self.index, 'nprobe'):
+            self.index.nprobe = IVF_NPROBE
+        
+        # OMP_NUM_THREADS, if set, already governs this; otherwise leave half the cores for the app
+        if 'OMP_NUM_THREADS' not in os.environ:
+            faiss.omp_set_num_threads(max(1, (os.cpu_count() or 2) // 2))
         
         with open(metadata_file, 'r') as f:
             self.metadata = json.load(f)
             
         print(f"Loaded index with {len(self.metadata)} chunks")
     
+    @staticmethod
+    def _mmap_flags(index_file: Path) -> int:
+        """
+        Read flags that memory-map the bulk of a stored index
+        
+        IO_FLAG_MMAP only maps IVF inverted lists; flat-code indexes (flat, SQ and
+        the SQ storage under HNSW) need IO_FLAG_MMAP_IFC. An HNSW graph is still
+        read into memory either way.
+        """
+        with open(index_file, 'rb') as f:
+            fourcc = f.read(4)
+        # IVF index types are tagged "Iw.."
+        if fourcc.startswith(b'Iw'):
+            return faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+        return faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY
+    
+    def _embed_query(self, text: str) -> bytes:
+        """Embed and L2-normalize a text as float32 bytes, via the on-disk store"""
+        key = DiskCache.make_key(self.embedding_model, text)
+        cached = self.embedding_store.get(key)
+        if cached is not None:
+            return cached
+        
+        return self._store_embedding(key, self._embed_texts([text])[0])
+    
+    def _embed_texts(self, texts: List[str]) -> np.ndarray:
+        """Embed texts as L2-normalized float32 rows with the configured backend"""
+        if self.local:
+            return embed_locally(texts)
+        
+        embeddings = self._request_embeddings(texts)
+        faiss.normalize_L2(embeddings)
+        return embeddings
+    
+    @llm_retry
+    def _request_embeddings(self, texts: List[str]) -> np.ndarray:
+        """Call the embeddings API, retrying transient errors like the async path does"""
+        response = self.client.embeddings.create(model=self.embedding_model, input=texts)
+        return np.array([emb.embedding for emb in response.data], dtype='float32')
+    
+    def _store_embedding(self, key: str, vector: np.ndarray) -> bytes:
+        """Persist a normalized embedding as float32 bytes and return them"""
+        blob = vector.tobytes()
+        self.embedding_store.set(key, blob)
+        return blob
+    
     def get_embedding(self, text: str) -> np.ndarray:
-        """Get embedding for a single text"""
+        """Get the L2-normalized embedding for a single text, shape (1, dim)"""
         try:
-            response = self.client.embeddings.create(
-                model=self.embedding_model,
-                input=[text]
-            )
-            # Convert to numpy array and ensure float32
-            embedding = np.array([response.data[0].embedding], dtype='float32')
-            return embedding
+            # Copy: the cached bytes are shared and read-only
+            return np.frombuffer(self._embed(text), dtype='float32').reshape(1, -1).copy()
         except Exception as e:
             print(f"Error getting embedding: {str(e)}")
             raise
@@ -63,16 +142,9 @@ class RAGRetriever:
             return []
             
         try:
-            # Get query embedding
+            # Get query embedding, already normalized for cosine similarity
             query_embedding = self.get_embedding(query)
             
-            # Ensure query_embedding is 2D and float32
-            if len(query_embedding.shape) == 1:
-                query_embedding = query_embedding.reshape(1, -1)
-            
-            # Normalize for cosine similarity
-            faiss.normalize_L2(query_embedding)
-            
             # Ensure k doesn't exceed number of vectors in index
             k = min(k, self.index.ntotal) if self.index.ntotal > 0 else 0
             if k == 0:
@@ -80,21 +152,58 @@ class RAGRetriever:
             
             # Search index
             scores, indices = self.index.search(query_embedding, k)
-            
-            # Format results
-            results = []
-            for score, idx in zip(scores[0], indices[0]):
-                if idx < len(self.metadata):
-                    result = self.metadata[idx].copy()
-                    result['relevance_score'] = float(score)
-                    results.append(result)
-            
-            return results
+            return self._format_results(scores[0], indices[0])
             
         except Exception as e:
             print(f"Error in retrieve: {str(e)}")
             return []
     
+    def retrieve_batch(self, queries: List[str], k: int = 4) -> List[List[Dict]]:
+        """Retrieve top-k guidelines for several queries with one embedding request and one search"""
+        if not self.index or self.index.ntotal == 0 or not queries:
+            return [[] for _ in queries]
+        
+        try:
+            scores, indices = self.index.search(self.get_embeddings(queries), min(k, self.index.ntotal))
+            return [self._format_results(row_scores, row_indices) for row_scores, row_indices in zip(scores, indices)]
+        except Exception as e:
+            print(f"Error in retrieve_batch: {str(e)}")
+            return [[] for _ in queries]
+    
+    def get_embeddings(self, texts: List[str]) -> np.ndarray:
+        """Get L2-normalized embeddings for several texts, requesting only those not in the store"""
+        keys = [DiskCache.make_key(self.embedding_model, text) for text in texts]
+        blobs = [self.embedding_store.get(key) for key in keys]
+        missing = [i for i, blob in enumerate(blobs) if blob is None]
+        
+        if missing:
+            fresh = self._embed_texts([texts[i] for i in missing])
+            for i, row in zip(missing, fresh):
+                blobs[i] = row.tobytes()
+            self.embedding_store.set_many((keys[i], blobs[i]) for i in missing)
+        
+        return np.vstack([np.frombuffer(blob, dtype='float32') for blob in blobs])
+    
+    def _format_results(self, scores: np.ndarray, indices: np.ndarray) -> List[Dict]:
+        """Attach relevance scores to the metadata of one query's hits"""
+        results = []
+        for score, idx in zip(scores, indices):
+            # Approximate indexes pad with -1 when they find fewer than k hits
+            if 0 <= idx < len(self.metadata):
+                result = self.metadata[idx].copy()
+                result['relevance_score'] = float(score)
+                results.append(result)
+        return results
+    
+    def warm_up(self, queries=WARMUP_QUERIES, k: int = 4):
+        """Run throwaway searches so the first real retrieval doesn't pay cold-start costs"""
+        if not self.index or self.index.ntotal == 0:
+            return
+        
+        # One embedding request for all queries opens the HTTPS connection (or loads
+        # the local model); the search pages in the index
+        self.index.search(self._embed_texts(list(queries)), min(k, self.index.ntotal))
+    
     def build_retrieval_query(self, patient_data: Dict) -> str:
         """Build retrieval query from patient context"""
         query_parts = []
@@ -127,6 +236,31 @@ class RAGRetriever:
         
         query = ' '.join(query_parts)
         return query or "diabetes management guidelines"
+    
+    def build_retrieval_subqueries(self, patient_data: Dict) -> List[str]:
+        """Build labs, lifestyle and medication/screening queries for parallel retrieval"""
+        diabetes = f"{patient_data['diabetes_type']} diabetes" if patient_data.get('diabetes_type') else "diabetes"
+        labs = patient_data.get('labs', {})
+        
+        lab_parts = [diabetes]
+        if labs.get('hba1c_pct'):
+            lab_parts.append("HbA1c blood glucose control")
+        if patient_data.get('bp_sys'):
+            lab_parts.append("blood pressure hypertension")
+        if labs.get('lipids'):
+            lab_parts.append("cholesterol lipids cardiovascular risk")
+        
+        lifestyle_parts = [diabetes, "diet carbohydrate counting lifestyle"]
+        if (patient_data.get('hypos_90d') or 0) > 0:
+            lifestyle_parts.append("hypoglycaemia management")
+        
+        med_parts = [diabetes]
+        meds = patient_data.get('meds', [])
+        if any('insulin' in med.get('name', '').lower() for med in meds):
+            med_parts.append("insulin therapy")
+        med_parts.append("screening retinopathy kidney foot")
+        
+        return [' '.join(parts) for parts in (lab_parts, lifestyle_parts, med_parts)]
 
 if __name__ == "__main__":
     retriever = RAGRetriever()
@@ -0,0 +1,189 @@
+"""
+Similarity cache for generated reports over near-identical patient intakes
+"""
+import os
+import threading
+import numpy as np
+import orjson
+from functools import lru_cache
+from typing import Dict, List, Optional
+from pathlib import Path
+from llm.client import get_openai_client
+
+# Largest difference in each clinical value that still counts as the same intake;
+# text embeddings barely register numeric edits, so these gate every hit
+NUMERIC_TOLERANCES = {
+    "height_cm": 1.0,
+    "weight_kg": 1.0,
+    "bp_sys": 2.0,
+    "bp_dia": 2.0,
+    "hypos_90d": 0,
+    "severe_hypos_90d": 0,
+    "dka_12m": 0,
+    "hba1c_pct": 0.1,
+    "fpg_mmol": 0.2,
+    "ppg2h_mmol": 0.2,
+    "egfr": 2.0,
+    "creatinine_umol": 5.0,
+    "acr_mgmmol": 0.3,
+    "tc": 0.1,
+    "ldl": 0.1,
+    "hdl": 0.1,
+    "tg": 0.1,
+}
+
+# Intake fields that must be identical for a report to be reused
+EXACT_FIELDS = (
+    "diabetes_type", "sex", "dob", "meds", "allergies", "comorbidities",
+    "devices", "lifestyle", "screenings", "goals",
+)
+
+class SemanticReportCache:
+    """Reuse a report when a patient's edited intake embeds almost identically to one already generated"""
+
+    def __init__(self, path: str = ".cache/semantic_cache.npz", api_key: str = None,
+                 threshold: float = 0.98, max_entries: int = 256):
+        self.client = get_openai_client(api_key or os.getenv('OPENAI_API_KEY'))
+        self.embedding_model = "text-embedding-3-small"
+        self.path = Path(path)
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+        # Row i of vectors is the normalized intake embedding for uuids[i] / values[i] / reports[i]
+        self.vectors = np.empty((0, 0), dtype='float32')
+        self.uuids: List[str] = []
+        self.values: List[Dict] = []
+        self.reports: List[Dict] = []
+        self._embed = lru_cache(maxsize=64)(self._embed_fingerprint)
+        self._load()
+
+    @staticmethod
+    def fingerprint(patient_data: Dict) -> str:
+        """Deterministic text summary of the intake fields that drive the report"""
+        labs = patient_data.get('labs') or {}
+        lipids = labs.get('lipids') or {}
+
+        def rounded(value):
+            return round(value, 1) if isinstance(value, (int, float)) else value
+
+        parts = [
+            f"type={patient_data.get('diabetes_type')}",
+            f"sex={patient_data.get('sex')}",
+            f"dob={patient_data.get('dob')}",
+            f"height={rounded(patient_data.get('height_cm'))}",
+            f"weight={rounded(patient_data.get('weight_kg'))}",
+            f"bp={rounded(patient_data.get('bp_sys'))}/{rounded(patient_data.get('bp_dia'))}",
+            f"hypos={patient_data.get('hypos_90d')}/{patient_data.get('severe_hypos_90d')}",
+            f"dka={patient_data.get('dka_12m')}",
+        ]
+        parts.extend(f"{key}={rounded(value)}" for key, value in sorted(labs.items()) if key != 'lipids')
+        parts.extend(f"{key}={rounded(value)}" for key, value in sorted(lipids.items()))
+        parts.append("meds=" + ",".join(sorted(med.get('name', '').lower() for med in patient_data.get('meds', []))))
+        return "; ".join(parts)
+
+    @staticmethod
+    def clinical_values(patient_data: Dict) -> Dict:
+        """The intake fields checked by values_match, in a form that survives the on-disk round trip"""
+        labs = patient_data.get('labs') or {}
+        sources = (patient_data, labs, labs.get('lipids') or {})
+        values = {}
+        for key in NUMERIC_TOLERANCES:
+            value = next((source[key] for source in sources if source.get(key) is not None), None)
+            values[key] = float(value) if isinstance(value, (int, float)) else value
+        for key in EXACT_FIELDS:
+            value = patient_data.get(key)
+            if isinstance(value, list):
+                # Order of entry doesn't change the clinical picture
+                value = sorted(value, key=lambda item: orjson.dumps(item, option=orjson.OPT_SORT_KEYS, default=str))
+            # Canonical JSON text compares the same before and after a round trip through disk
+            values[key] = orjson.dumps(value, option=orjson.OPT_SORT_KEYS, default=str).decode()
+        return values
+
+    @staticmethod
+    def values_match(cached: Optional[Dict], current: Dict) -> bool:
+        """True if every exact field is unchanged and every numeric value is within its tolerance"""
+        if not cached or any(cached.get(key) != current[key] for key in EXACT_FIELDS):
+            return False
+        for key, tolerance in NUMERIC_TOLERANCES.items():
+            old, new = cached.get(key), current[key]
+            if old is None or new is None:
+                if old is not new:
+                    return False
+            elif not isinstance(old, float) or not isinstance(new, float):
+                if old != new:
+                    return False
+            elif abs(old - new) > tolerance:
+                return False
+        return True
+
+    def _embed_fingerprint(self, fingerprint: str) -> np.ndarray:
+        """Embed and L2-normalize an intake fingerprint"""
+        response = self.client.embeddings.create(model=self.embedding_model, input=[fingerprint])
+        vector = np.asarray(response.data[0].embedding, dtype='float32')
+        return vector / max(np.linalg.norm(vector), 1e-12)
+
+    def lookup(self, patient_data: Dict) -> Optional[Dict]:
+        """Return a cached report for this patient if a near-identical intake was seen, else None"""
+        uuid = patient_data.get('uuid')
+        values = self.clinical_values(patient_data)
+        with self._lock:
+            candidates = [
+                i for i, (cached_uuid, cached_values) in enumerate(zip(self.uuids, self.values))
+                if cached_uuid == uuid and self.values_match(cached_values, values)
+            ]
+            if not candidates:
+                return None
+            vectors = self.vectors[candidates]
+
+        query = self._embed(self.fingerprint(patient_data))
+        sims = vectors @ query
+        best = int(np.argmax(sims))
+        if sims[best] < self.threshold:
+            return None
+
+        with self._lock:
+            return self.reports[candidates[best]]
+
+    def add(self, patient_data: Dict, report: Dict):
+        """Cache a generated report, evicting the oldest entries beyond max_entries"""
+        vector = self._embed(self.fingerprint(patient_data))
+
+        with self._lock:
+            if self.vectors.size:
+                self.vectors = np.vstack([self.vectors, vector])[-self.max_entries:]
+            else:
+                self.vectors = vector[np.newaxis, :]
+            self.uuids = (self.uuids + [patient_data.get('uuid')])[-self.max_entries:]
+            self.values = (self.values + [self.clinical_values(patient_data)])[-self.max_entries:]
+            self.reports = (self.reports + [report])[-self.max_entries:]
+            self._save()
+
+    def _load(self):
+        """Load cached vectors and reports from disk, if present"""
+        if not self.path.exists():
+            return
+
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                self.vectors = data['vectors']
+                entries = orjson.loads(data['entries'].tobytes())
+            self.uuids = [entry['uuid'] for entry in entries]
+            # Entries saved before values were recorded never match
+            self.values = [entry.get('values') for entry in entries]
+            self.reports = [entry['report'] for entry in entries]
+        except Exception as e:
+            print(f"Ignoring unreadable semantic cache: {str(e)}")
+
+    def _save(self):
+        """Persist the cache atomically; called with the lock held"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        entries = [
+            {"uuid": uuid, "values": values, "report": report}
+            for uuid, values, report in zip(self.uuids, self.values, self.reports)
+        ]
+
+        tmp_file = self.path.with_suffix('.npz.tmp')
+        with open(tmp_file, 'wb') as f:
+            np.savez(f, vectors=self.vectors, entries=np.frombuffer(orjson.dumps(entries), dtype=np.uint8))
+        os.replace(tmp_file, self.path)
@@ -1,21 +1,26 @@
 """Rules module for diabetes management application."""
-import json
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Any, Optional, Tuple
+from typing import Callable, Dict, Any, Optional, Tuple
+import numpy as np
+import orjson
 
+@lru_cache(maxsize=1)
 def load_rules() -> Dict[str, Any]:
     """Load and return the rules from rules.json.
     
+    The file is parsed once per process and the same dict is returned on
+    every call, so callers must treat it as read-only.
+    
     Returns:
         Dict containing the loaded rules.
     """
     rules_path = Path(__file__).parent / 'rules.json'
     try:
-        with open(rules_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        return orjson.loads(rules_path.read_bytes())
     except FileNotFoundError:
         raise FileNotFoundError(f"Rules file not found at {rules_path}")
-    except json.JSONDecodeError as e:
+    except orjson.JSONDecodeError as e:
         raise ValueError(f"Error parsing rules file: {e}")
 
 def get_traffic_light_status(metric_name: str, value: float, rules: Dict) -> str:
@@ -29,33 +34,78 @@ def get_traffic_light_status(metric_name: str, value: float, rules: Dict) -> str
     Returns:
         str: 'red', 'amber', or 'green'
     """
-    if not rules or 'traffic' not in rules or metric_name not in rules['traffic']:
+    classifiers = _default_classifiers() if rules is load_rules() else compile_traffic_rules(rules)
+    classify = classifiers.get(metric_name)
+    if classify is None:
         return 'green'  # Default to green if no thresholds defined
+    return classify(value)
+
+_STATUS_NAMES = np.array(['green', 'amber', 'red'])
+
+def _compile_thresholds(rules: Dict) -> Dict[str, Tuple[float, float]]:
+    """Flatten traffic thresholds to (green_max, amber_max) pairs, inf where unset"""
+    return {
+        name: (t.get('green_max', np.inf), t.get('amber_max', np.inf))
+        for name, t in (rules or {}).get('traffic', {}).items()
+    }
+
+@lru_cache(maxsize=1)
+def _default_thresholds() -> Dict[str, Tuple[float, float]]:
+    """Thresholds for the process-wide rules, compiled once"""
+    return _compile_thresholds(load_rules())
+
+def _make_classifier(green_max: float, amber_max: float) -> Callable[[float], str]:
+    """Bind one metric's thresholds into a classifier, so calls skip the rules dict"""
+    def classify(value: float) -> str:
+        return 'green' if value <= green_max else 'amber' if value <= amber_max else 'red'
+    return classify
+
+def compile_traffic_rules(rules: Dict) -> Dict[str, Callable[[float], str]]:
+    """Compile each metric's traffic thresholds into a value -> status function"""
+    return {name: _make_classifier(*bounds) for name, bounds in _compile_thresholds(rules).items()}
+
+@lru_cache(maxsize=1)
+def _default_classifiers() -> Dict[str, Callable[[float], str]]:
+    """Classifiers for the process-wide rules, compiled once"""
+    return compile_traffic_rules(load_rules())
+
+def get_traffic_light_statuses(values: Dict[str, float], rules: Dict) -> Dict[str, str]:
+    """Get traffic light statuses for several metrics in one vectorized pass.
+    
+    Args:
+        values: Mapping of metric name to numeric value
+        rules: Dictionary containing the rules
         
-    thresholds = rules['traffic'].get(metric_name, {})
+    Returns:
+        Dict mapping each metric name to 'red', 'amber', or 'green'
+    """
+    if not values:
+        return {}
+    
+    thresholds = _default_thresholds() if rules is load_rules() else _compile_thresholds(rules)
+    # Metrics without thresholds compare against inf and so default to green
+    unset = (np.inf, np.inf)
+    green_max, amber_max = np.array([thresholds.get(name, unset) for name in values], dtype=np.float64).T
+    observed = np.fromiter(values.values(), dtype=np.float64, count=len(values))
     
-    if value <= thresholds.get('green_max', float('inf')):
-        return 'green'
-    elif value <= thresholds.get('amber_max', float('inf')):
-        return 'amber'
-    else:
-        return 'red'
+    # 0 = within green, 1 = past green only, 2 = past amber too
+    status_idx = (observed > green_max).astype(np.int8) + (observed > amber_max).astype(np.int8)
+    return dict(zip(values, _STATUS_NAMES[status_idx].tolist()))
+
+_EMOJI = ('🔴', '🟠', '🟢', '⚪')
+_EMOJI_INDEX = {'red': 0, 'amber': 1, 'green': 2}
 
 def get_traffic_light_emoji(status: str) -> str:
     """Get emoji for a traffic light status.
     
     Args:
-        status: Traffic light status ('red', 'amber', or 'green')
+        status: Traffic light status ('red', 'amber', or 'green'), lowercase
+            as returned by get_traffic_light_status
         
     Returns:
         str: Emoji representation of the status
     """
-    emoji_map = {
-        'red': '🔴',
-        'amber': '🟠',
-        'green': '🟢'
-    }
-    return emoji_map.get(status.lower(), '⚪')
+    return _EMOJI[_EMOJI_INDEX.get(status, 3)]
 
 # Make functions available at the package level
-__all__ = ['load_rules', 'get_traffic_light_status', 'get_traffic_light_emoji']
+__all__ = ['load_rules', 'get_traffic_light_status', 'get_traffic_light_statuses', 'compile_traffic_rules', 'get_traffic_light_emoji']
@@ -1,10 +1,19 @@
 """
 Pydantic schemas for diabetes report system
 """
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 from typing import List, Optional, Literal, Dict
 from datetime import date
 
+class MedEntry(BaseModel):
+    """One medication line from the intake form"""
+    model_config = ConfigDict(str_strip_whitespace=True)
+
+    name: str
+    dose: str = ""
+    schedule: str = ""
+    notes: str = ""
+
 class PatientIntake(BaseModel):
     uuid: str
     name: str
@@ -33,7 +42,8 @@ class PatientIntake(BaseModel):
     goals: Optional[str] = None
     notes: Optional[str] = None
 
-    @validator('dob')
+    @field_validator('dob')
+    @classmethod
     def validate_dob(cls, v):
         try:
             # Validate date format
@@ -2,12 +2,11 @@
 Patient data models for the Diabetes Consultant application.
 Uses Pydantic for data validation and serialization.
 """
+from bisect import bisect_right
 from datetime import date, datetime
 from enum import Enum
 from typing import List, Optional, Dict, Any, Union
-from pydantic import BaseModel, Field, validator
-from pydantic.functional_validators import model_validator
-import re
+from pydantic import BaseModel, ConfigDict, Field, field_validator, model_validator
 
 class Sex(str, Enum):
     MALE = "Male"
@@ -62,6 +61,13 @@ class CKDStage(str, Enum):
     NONE = "No CKD"
     UNKNOWN = "Unknown"
 
+# eGFR stage boundaries (lower bound of each stage) and the stage for each bin, lowest first
+_EGFR_BINS = (15, 30, 45, 60, 90)
+_CKD_STAGES = (
+    CKDStage.STAGE5, CKDStage.STAGE4, CKDStage.STAGE3B,
+    CKDStage.STAGE3A, CKDStage.STAGE2, CKDStage.STAGE1,
+)
+
 class Medication(BaseModel):
     name: str
     dose: str
@@ -148,20 +154,23 @@ class PatientBase(BaseModel):
     updated_at: datetime = Field(default_factory=datetime.utcnow)
     
     # Validators
-    @validator('nhs_number')
+    @field_validator('nhs_number')
+    @classmethod
     def validate_nhs_number(cls, v):
         if v is None:
             return v
         # Simple NHS number validation (10 digits, last digit is check digit)
-        if not re.match(r'^\d{10}$', v):
+        # isascii: str.isdigit alone also accepts superscripts and non-Latin digits
+        if len(v) != 10 or not (v.isascii() and v.isdigit()):
             raise ValueError("NHS number must be 10 digits")
         return v
     
-    @validator('date_of_birth', 'diagnosis_date', pre=True)
+    @field_validator('date_of_birth', 'diagnosis_date', mode='before')
+    @classmethod
     def parse_dates(cls, v):
         if isinstance(v, str):
             try:
-                return datetime.strptime(v, '%Y-%m-%d').date()
+                return date.fromisoformat(v)
             except ValueError:
                 raise ValueError("Date must be in YYYY-MM-DD format")
         return v
@@ -174,51 +183,28 @@ class PatientBase(BaseModel):
             self.bmi = round(self.weight_kg / (height_m ** 2), 1)
         
         # Calculate diabetes duration in years
-        if hasattr(self, 'diagnosis_date') and hasattr(self, 'date_of_birth'):
-            if self.diagnosis_date and self.date_of_birth:
-                if self.diagnosis_date < self.date_of_birth:
-                    raise ValueError("Diagnosis date cannot be before date of birth")
-                
-                # Calculate diabetes duration in years
-                duration_days = (datetime.now().date() - self.diagnosis_date).days
-                self.diabetes_duration_years = round(duration_days / 365.25, 1)
+        if self.diagnosis_date and self.date_of_birth:
+            if self.diagnosis_date < self.date_of_birth:
+                raise ValueError("Diagnosis date cannot be before date of birth")
+            
+            duration_days = (date.today() - self.diagnosis_date).days
+            self.diabetes_duration_years = round(duration_days / 365.25, 1)
         
         # Set CKD stage based on eGFR if not explicitly set
-        if hasattr(self, 'egfr') and self.egfr is not None:
-            if not hasattr(self, 'ckd_stage') or self.ckd_stage is None:
-                if self.egfr >= 90:
-                    self.ckd_stage = CKDStage.STAGE1
-                elif 60 <= self.egfr < 90:
-                    self.ckd_stage = CKDStage.STAGE2
-                elif 45 <= self.egfr < 60:
-                    self.ckd_stage = CKDStage.STAGE3A
-                elif 30 <= self.egfr < 45:
-                    self.ckd_stage = CKDStage.STAGE3B
-                elif 15 <= self.egfr < 30:
-                    self.ckd_stage = CKDStage.STAGE4
-                elif self.egfr < 15:
-                    self.ckd_stage = CKDStage.STAGE5
-                else:
-                    self.ckd_stage = CKDStage.NONE
+        if self.egfr is not None and self.ckd_stage is None:
+            self.ckd_stage = _CKD_STAGES[bisect_right(_EGFR_BINS, self.egfr)]
         
         # Convert HbA1c between % and mmol/mol if only one is provided
-        if hasattr(self, 'hba1c_percent') and self.hba1c_percent is not None:
-            if not hasattr(self, 'hba1c_mmol_mol') or self.hba1c_mmol_mol is None:
+        if self.hba1c_percent is not None:
+            if self.hba1c_mmol_mol is None:
                 self.hba1c_mmol_mol = round((self.hba1c_percent - 2.15) * 10.929, 1)
-        elif hasattr(self, 'hba1c_mmol_mol') and self.hba1c_mmol_mol is not None:
-            if not hasattr(self, 'hba1c_percent') or self.hba1c_percent is None:
-                self.hba1c_percent = round((self.hba1c_mmol_mol * 0.0915) + 2.15, 1)
+        elif self.hba1c_mmol_mol is not None:
+            self.hba1c_percent = round((self.hba1c_mmol_mol * 0.0915) + 2.15, 1)
         
         # Update timestamp
         self.updated_at = datetime.utcnow()
         
         return self
-    
-    class Config:
-        json_encoders = {
-            date: lambda v: v.isoformat(),
-            datetime: lambda v: v.isoformat(),
-        }
 
 class PatientCreate(PatientBase):
     pass
@@ -229,8 +215,7 @@ class PatientUpdate(PatientBase):
 class PatientInDB(PatientBase):
     id: str  # UUID
     
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 # Example usage:
 # patient = Patient(
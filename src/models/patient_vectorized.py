@@ -0,0 +1,45 @@
+"""
+Vectorized derived fields for patient cohorts.
+Mirrors PatientBase.calculate_derived_fields without building a model per row.
+"""
+from typing import Dict
+import numpy as np
+from src.models.patient import _CKD_STAGES, _EGFR_BINS
+
+_EGFR_BOUNDS = np.array(_EGFR_BINS, dtype=np.float64)
+# Index len(_CKD_STAGES) is where missing eGFR values land
+_STAGE_LOOKUP = np.array(list(_CKD_STAGES) + [None], dtype=object)
+
+def derive(heights, weights, hba1c_pct, hba1c_mmol, egfr) -> Dict[str, np.ndarray]:
+    """Compute BMI, both HbA1c units and CKD stage for a cohort in one pass.
+    
+    Each argument is a sequence (list, ndarray or pandas Series) with one entry
+    per patient; use NaN for missing values.
+    
+    Returns:
+        Dict with 'bmi', 'hba1c_pct', 'hba1c_mmol' (float arrays, NaN where
+        underivable) and 'ckd_stage' (object array of CKDStage, None where eGFR
+        is missing)
+    """
+    heights = np.asarray(heights, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    hba1c_pct = np.asarray(hba1c_pct, dtype=np.float64)
+    hba1c_mmol = np.asarray(hba1c_mmol, dtype=np.float64)
+    egfr = np.asarray(egfr, dtype=np.float64)
+    
+    bmi = np.round(weights / (heights / 100) ** 2, 1)
+    
+    # Fill whichever HbA1c unit is missing from the other, as the model validator does
+    mmol = np.where(np.isnan(hba1c_mmol), np.round((hba1c_pct - 2.15) * 10.929, 1), hba1c_mmol)
+    pct = np.where(np.isnan(hba1c_pct), np.round(hba1c_mmol * 0.0915 + 2.15, 1), hba1c_pct)
+    
+    # side='right' matches bisect_right in the model, so eGFR 90 is stage 1
+    stage_idx = np.searchsorted(_EGFR_BOUNDS, egfr, side='right')
+    stage_idx[np.isnan(egfr)] = len(_CKD_STAGES)
+    
+    return {
+        'bmi': bmi,
+        'hba1c_pct': pct,
+        'hba1c_mmol': mmol,
+        'ckd_stage': _STAGE_LOOKUP[stage_idx],
+    }
@@ -2,20 +2,34 @@
 Clinical rule engine for diabetes management.
 Evaluates patient data against clinical guidelines and returns relevant flags.
 """
-from typing import List, Dict, Any, Optional
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field, replace
+from functools import lru_cache
+from typing import List, Dict, Any, NamedTuple, Optional, Tuple
 from enum import Enum
+from graphlib import TopologicalSorter
 from datetime import date, datetime
-from pydantic import BaseModel, validator
+from pydantic import BaseModel, Field
 from .patient import PatientBase, DiabetesType, CKDStage
 
+# CKD stages 3a-5 lower the BP and LDL-C targets
+_CKD_HIGH_RISK = frozenset({CKDStage.STAGE3A, CKDStage.STAGE3B, CKDStage.STAGE4, CKDStage.STAGE5})
+
+# Comorbidity names that mark established cardiovascular disease
+_CVD_NAMES = frozenset({"cvd", "cad", "mi", "stroke", "pad"})
+
+# Below this many patients, process start-up and pickling cost more than they save
+MIN_PARALLEL_PATIENTS = 64
+
 class RuleSeverity(str, Enum):
     CRITICAL = "critical"
     WARNING = "warning"
     INFO = "info"
     SUCCESS = "success"
 
-class ClinicalFlag(BaseModel):
-    """A clinical flag raised by the rule engine."""
+class ClinicalFlagModel(BaseModel):
+    """Validated form of a ClinicalFlag, for API and serialization boundaries."""
     id: str
     title: str
     description: str
@@ -25,12 +39,308 @@ class ClinicalFlag(BaseModel):
     rationale: str
     citation_ids: List[str] = []
     affected_parameters: List[str] = []
-    timestamp: datetime = datetime.utcnow()
+    timestamp: datetime = Field(default_factory=datetime.utcnow)
+
+# A plain dataclass: rules build one per finding, and pydantic validation of
+# values the engine itself produced is pure overhead. (No slots=True: the
+# deployed runtime is Python 3.9.)
+@dataclass(frozen=True)
+class ClinicalFlag:
+    """A clinical flag raised by the rule engine."""
+    id: str
+    title: str
+    description: str
+    severity: RuleSeverity
+    category: str
+    recommendation: str
+    rationale: str
+    citation_ids: Tuple[str, ...] = ()
+    affected_parameters: Tuple[str, ...] = ()
+    timestamp: datetime = field(default_factory=datetime.utcnow)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Plain dict of the flag's fields, ready for orjson."""
+        return asdict(self)
+    
+    def to_pydantic(self) -> ClinicalFlagModel:
+        """Convert to the validated pydantic model."""
+        return ClinicalFlagModel(**self.to_dict())
+
+@dataclass(frozen=True)
+class RuleCtx:
+    """Values shared by every rule during one evaluate_patient call."""
+    today: date
+
+class _MedicationInputs(NamedTuple):
+    is_insulin: bool
+    is_sulfonylurea: bool
+
+class _ComorbidityInputs(NamedTuple):
+    name: str
+
+class RuleInputs(NamedTuple):
+    """
+    The patient fields the rules read, as a hashable snapshot.
+    
+    Rules run against this rather than the PatientBase itself, so it doubles
+    as the memo key and cannot miss a field a rule depends on.
+    """
+    diabetes_type: DiabetesType
+    hba1c_percent: Optional[float]
+    bp_systolic: Optional[int]
+    bp_diastolic: Optional[int]
+    ckd_stage: Optional[CKDStage]
+    acr: Optional[float]
+    ldl_mmol: Optional[float]
+    medications: Tuple[_MedicationInputs, ...]
+    hypos_last_90_days: Optional[int]
+    comorbidities: Tuple[_ComorbidityInputs, ...]
+    smoking_status: Any
+    last_foot_screen: Optional[date]
+    last_retinal_screen: Optional[date]
+    last_renal_screen: Optional[date]
     
-    class Config:
-        json_encoders = {
-            datetime: lambda v: v.isoformat(),
-        }
+    @classmethod
+    def from_patient(cls, patient: PatientBase) -> 'RuleInputs':
+        """Snapshot the rule inputs from a patient."""
+        return cls(
+            diabetes_type=patient.diabetes_type,
+            hba1c_percent=patient.hba1c_percent,
+            bp_systolic=patient.bp_systolic,
+            bp_diastolic=patient.bp_diastolic,
+            ckd_stage=patient.ckd_stage,
+            acr=patient.acr,
+            ldl_mmol=patient.ldl_mmol,
+            medications=tuple(sorted({
+                _MedicationInputs(med.is_insulin, med.is_sulfonylurea) for med in patient.medications
+            })),
+            hypos_last_90_days=patient.hypos_last_90_days,
+            comorbidities=tuple(sorted({_ComorbidityInputs(c.name.lower()) for c in patient.comorbidities})),
+            smoking_status=patient.smoking_status,
+            last_foot_screen=patient.last_foot_screen,
+            last_retinal_screen=patient.last_retinal_screen,
+            last_renal_screen=patient.last_renal_screen,
+        )
+
+# Availability bits for the inputs a rule needs before it can fire
+HAS_HBA1C = 1 << 0
+HAS_BP = 1 << 1
+HAS_ACR = 1 << 2
+HAS_MEDICATIONS = 1 << 3
+HAS_LDL = 1 << 4
+
+def _availability(patient: RuleInputs) -> int:
+    """Bitmap of which rule inputs are present on a patient."""
+    return (
+        (patient.hba1c_percent is not None) * HAS_HBA1C
+        | (patient.bp_systolic is not None and patient.bp_diastolic is not None) * HAS_BP
+        | (patient.acr is not None) * HAS_ACR
+        | bool(patient.medications) * HAS_MEDICATIONS
+        | (patient.ldl_mmol is not None) * HAS_LDL
+    )
+
+def _months_between(earlier: date, today: date) -> int:
+    """Whole calendar months from earlier to today."""
+    return (today.year - earlier.year) * 12 + (today.month - earlier.month)
+
+def rule(requires: int = 0, provides: Tuple[str, ...] = (), suppresses: Tuple[str, ...] = ()):
+    """
+    Attach evaluation metadata to a RuleEngine check.
+    
+    Args:
+        requires: Availability bits that must all be set for the rule to run
+        provides: Ids of the flags the rule can raise
+        suppresses: Flag ids that, once raised, make this rule redundant
+    """
+    def decorate(func):
+        func.requires = requires
+        func.provides = frozenset(provides)
+        func.suppresses = frozenset(suppresses)
+        return func
+    return decorate
+
+# Static parts of each flag, built once at import; rules only fill in the
+# fields that depend on the patient
+_HBA1C_ABOVE_TARGET = {
+    "id": "hba1c_above_target",
+    "category": "Glycemic Control",
+    "recommendation": (
+        "Consider intensifying diabetes management. Review medications, diet, and lifestyle. "
+        "Consider referral to diabetes specialist if not already done."
+    ),
+    "citation_ids": ("NG17#1.6.1", "NG28#1.3.1"),
+    "affected_parameters": ("hba1c_percent", "diabetes_type"),
+}
+
+_BP_TIGHTEN_CONTROL = {
+    "id": "bp_tighten_control",
+    "category": "Blood Pressure",
+    "recommendation": (
+        "Consider optimizing antihypertensive therapy. Review current medications, "
+        "lifestyle modifications, and adherence. Consider 24-hour ambulatory BP monitoring."
+    ),
+    "citation_ids": ("NG28#1.11.1", "NG203#1.2.1"),
+    "affected_parameters": ("bp_systolic", "bp_diastolic", "ckd_stage"),
+}
+
+_ALBUMINURIA_PRESENT = {
+    "id": "albuminuria_present",
+    "category": "Renal Health",
+    "recommendation": (
+        "Consider ACE inhibitor or ARB therapy if not contraindicated. "
+        "Monitor renal function and potassium. Optimize glycemic and blood pressure control."
+    ),
+    "rationale": (
+        "Albuminuria is a marker of kidney damage and increased cardiovascular risk. "
+        "Early intervention with RAAS blockade can slow progression of kidney disease."
+    ),
+    "citation_ids": ("NG28#1.6.1", "NG203#1.5.1"),
+    "affected_parameters": ("acr",),
+}
+
+_HYPO_RISK_FROM_MEDS = {
+    "id": "hypo_risk_from_meds",
+    "category": "Medication Safety",
+    "recommendation": (
+        "Educate on hypoglycemia recognition/treatment. Consider continuous glucose monitoring. "
+        "Review insulin-to-carb ratios and correction factors. Consider de-escalation if appropriate."
+    ),
+    "citation_ids": ("NG17#1.8.1", "NG28#1.6.5"),
+    "affected_parameters": ("medications", "hypos_last_90_days"),
+}
+
+_LDL_ABOVE_TARGET = {
+    "id": "ldl_above_target",
+    "category": "Lipid Management",
+    "recommendation": (
+        "Consider high-intensity statin therapy if not already prescribed. "
+        "Optimize lifestyle modifications. Consider ezetimibe or PCSK9 inhibitors if targets not met."
+    ),
+    "citation_ids": ("NG28#1.10.1", "CG181#1.2.1"),
+    "affected_parameters": ("ldl_mmol", "ckd_stage", "comorbidities"),
+}
+
+_CURRENT_SMOKER = {
+    "id": "current_smoker",
+    "title": "Current smoker - cessation support needed",
+    "description": "Patient reports current tobacco use, which significantly increases cardiovascular risk.",
+    "severity": RuleSeverity.CRITICAL,
+    "category": "Lifestyle",
+    "recommendation": (
+        "Offer smoking cessation support. Consider referral to stop-smoking services. "
+        "Discuss pharmacotherapy options (varenicline, bupropion, NRT). Set a quit date within 4 weeks."
+    ),
+    "rationale": (
+        "Smoking cessation is the single most effective intervention to reduce cardiovascular risk in "
+        "people with diabetes. Even brief advice from a healthcare professional increases quit rates."
+    ),
+    "citation_ids": ("NG28#1.2.1", "PH10#1.1.1"),
+    "affected_parameters": ("smoking_status",),
+}
+
+_FOOT_SCREENING_DUE = {
+    "id": "foot_screening_due",
+    "title": "Foot screening not documented",
+    "description": "No record of annual diabetic foot screening.",
+    "severity": RuleSeverity.WARNING,
+    "category": "Preventive Care",
+    "recommendation": (
+        "Perform annual diabetic foot assessment including inspection, palpation of pulses, "
+        "and assessment of neuropathy (10g monofilament and vibration perception). "
+        "Document risk category and provide appropriate foot care education."
+    ),
+    "rationale": (
+        "Annual foot assessment is recommended for all people with diabetes to identify risk factors "
+        "for foot ulceration and amputation. Early identification of risk factors can prevent complications."
+    ),
+    "citation_ids": ("NG19#1.2.1", "NG28#1.7.1"),
+    "affected_parameters": ("last_foot_screen",),
+}
+
+_FOOT_SCREENING_OVERDUE = {
+    "id": "foot_screening_overdue",
+    "severity": RuleSeverity.WARNING,
+    "category": "Preventive Care",
+    "recommendation": (
+        "Schedule foot screening as soon as possible. Perform comprehensive assessment including "
+        "inspection, palpation of pulses, and assessment of neuropathy (10g monofilament and vibration perception)."
+    ),
+    "rationale": (
+        "Annual foot assessment is recommended for all people with diabetes to identify risk factors "
+        "for foot ulceration and amputation. Regular screening can detect problems early when they are "
+        "most treatable."
+    ),
+    "citation_ids": ("NG19#1.2.1",),
+    "affected_parameters": ("last_foot_screen",),
+}
+
+_RETINAL_SCREENING_DUE = {
+    "id": "retinal_screening_due",
+    "title": "Retinal screening not documented",
+    "description": "No record of annual diabetic retinal screening.",
+    "severity": RuleSeverity.WARNING,
+    "category": "Preventive Care",
+    "recommendation": (
+        "Refer for annual digital retinal photography. Ensure pupils are dilated for optimal imaging. "
+        "Document results and any required follow-up."
+    ),
+    "rationale": (
+        "Annual retinal screening is essential for early detection of diabetic retinopathy, "
+        "a leading cause of preventable blindness. Early treatment can prevent vision loss."
+    ),
+    "citation_ids": ("NG28#1.16.1", "NG17#1.13.1"),
+    "affected_parameters": ("last_retinal_screen",),
+}
+
+_RETINAL_SCREENING_OVERDUE = {
+    "id": "retinal_screening_overdue",
+    "severity": RuleSeverity.WARNING,
+    "category": "Preventive Care",
+    "recommendation": (
+        "Schedule retinal screening as soon as possible. Use mydriatic retinal photography "
+        "for optimal image quality. Document results and any required follow-up."
+    ),
+    "rationale": (
+        "Annual retinal screening is essential for early detection of diabetic retinopathy. "
+        "Delays in screening increase the risk of vision-threatening complications."
+    ),
+    "citation_ids": ("NG28#1.16.1",),
+    "affected_parameters": ("last_retinal_screen",),
+}
+
+_RENAL_SCREENING_DUE = {
+    "id": "renal_screening_due",
+    "title": "Renal screening not documented",
+    "description": "No record of annual renal screening (eGFR and ACR).",
+    "severity": RuleSeverity.WARNING,
+    "category": "Preventive Care",
+    "recommendation": (
+        "Order renal function tests including eGFR and ACR. Monitor for signs of chronic kidney disease. "
+        "Optimize blood pressure and glycemic control to preserve renal function."
+    ),
+    "rationale": (
+        "Annual assessment of renal function is recommended for all people with diabetes to detect "
+        "early signs of diabetic kidney disease. Early intervention can slow progression."
+    ),
+    "citation_ids": ("NG28#1.6.1", "NG203#1.5.1"),
+    "affected_parameters": ("last_renal_screen", "egfr", "acr"),
+}
+
+_RENAL_SCREENING_OVERDUE = {
+    "id": "renal_screening_overdue",
+    "severity": RuleSeverity.WARNING,
+    "category": "Preventive Care",
+    "recommendation": (
+        "Order renal function tests including eGFR and ACR. Consider additional testing if indicated. "
+        "Review medications that may affect renal function."
+    ),
+    "rationale": (
+        "Regular monitoring of renal function is essential for early detection and management of "
+        "diabetic kidney disease. Delays in screening may result in missed opportunities for intervention."
+    ),
+    "citation_ids": ("NG28#1.6.1",),
+    "affected_parameters": ("last_renal_screen",),
+}
 
 class RuleEngine:
     """Evaluates clinical rules against patient data."""
@@ -47,6 +357,14 @@ class RuleEngine:
             self._check_retinal_screening,
             self._check_renal_screening,
         ]
+        # A rule runs after every rule that provides a flag it is suppressed by
+        providers = {flag_id: check for check in self.rules for flag_id in check.provides}
+        graph = TopologicalSorter()
+        for check in self.rules:
+            graph.add(check, *(providers[flag_id] for flag_id in check.suppresses if flag_id in providers))
+        self._ordered_rules = tuple(graph.static_order())
+        # Re-rendering UIs evaluate the same patient many times over
+        self._evaluate_cached = lru_cache(maxsize=1024)(self._evaluate)
     
     def evaluate_patient(self, patient: PatientBase) -> List[ClinicalFlag]:
         """
@@ -58,120 +376,121 @@ class RuleEngine:
         Returns:
             List of ClinicalFlag objects representing any issues found
         """
+        flags = self._evaluate_cached(RuleInputs.from_patient(patient), date.today())
+        # Memo hits would otherwise carry the time of the first evaluation
+        now = datetime.utcnow()
+        return [replace(flag, timestamp=now) for flag in flags]
+    
+    def _evaluate(self, inputs: RuleInputs, today: date) -> Tuple[ClinicalFlag, ...]:
+        """Run the rules in order on one patient's inputs; memoized per engine."""
         flags = []
+        ctx = RuleCtx(today=today)
+        available = _availability(inputs)
+        fired = set()
         
-        for rule in self.rules:
+        for check in self._ordered_rules:
+            if available & check.requires != check.requires or not check.suppresses.isdisjoint(fired):
+                continue
             try:
-                flag = rule(patient)
+                flag = check(inputs, ctx)
                 if flag:
                     if isinstance(flag, list):
                         flags.extend(flag)
+                        fired.update(f.id for f in flag)
                     else:
                         flags.append(flag)
+                        fired.add(flag.id)
             except Exception as e:
                 # Log the error but continue with other rules
-                print(f"Error evaluating rule {rule.__name__}: {str(e)}")
+                print(f"Error evaluating rule {check.__name__}: {str(e)}")
         
-        return flags
+        return tuple(flags)
     
-    def _check_hba1c_above_target(self, patient: PatientBase) -> Optional[ClinicalFlag]:
-        """Check if HbA1c is above target for the patient's diabetes type."""
-        if patient.hba1c_percent is None:
-            return None
+    def evaluate_patients(self, patients: List[PatientBase]) -> List[List[ClinicalFlag]]:
+        """
+        Evaluate a batch of patients, in worker processes when the batch is large.
+        
+        Args:
+            patients: The patients to evaluate
             
+        Returns:
+            One list of ClinicalFlag objects per patient, in input order
+        """
+        if len(patients) < MIN_PARALLEL_PATIENTS:
+            return [self.evaluate_patient(patient) for patient in patients]
+        
+        workers = os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(_evaluate_in_worker, patients, chunksize=max(1, len(patients) // (workers * 4))))
+    
+    @rule(requires=HAS_HBA1C, provides=("hba1c_above_target",))
+    def _check_hba1c_above_target(self, patient: RuleInputs, ctx: RuleCtx) -> Optional[ClinicalFlag]:
+        """Check if HbA1c is above target for the patient's diabetes type."""
         target = 6.5 if patient.diabetes_type == DiabetesType.TYPE1 else 7.0
         
         if patient.hba1c_percent > target:
             return ClinicalFlag(
-                id="hba1c_above_target",
+                **_HBA1C_ABOVE_TARGET,
                 title=f"HbA1c above target ({patient.hba1c_percent}% > {target}%)",
                 description=(
                     f"Current HbA1c of {patient.hba1c_percent}% is above the target of {target}% "
                     f"for {patient.diabetes_type} diabetes."
                 ),
                 severity=RuleSeverity.WARNING if patient.hba1c_percent < 8.5 else RuleSeverity.CRITICAL,
-                category="Glycemic Control",
-                recommendation=(
-                    "Consider intensifying diabetes management. Review medications, diet, and lifestyle. "
-                    "Consider referral to diabetes specialist if not already done."
-                ),
                 rationale=(
                     f"NICE guidelines recommend an HbA1c target of {target}% for {patient.diabetes_type} diabetes. "
                     "Higher levels increase the risk of long-term complications."
-                ),
-                citation_ids=["NG17#1.6.1", "NG28#1.3.1"],
-                affected_parameters=["hba1c_percent", "diabetes_type"]
+                )
             )
         return None
     
-    def _check_bp_control(self, patient: PatientBase) -> Optional[ClinicalFlag]:
+    @rule(requires=HAS_BP, provides=("bp_tighten_control",))
+    def _check_bp_control(self, patient: RuleInputs, ctx: RuleCtx) -> Optional[ClinicalFlag]:
         """Check if blood pressure control needs adjustment."""
-        if patient.bp_systolic is None or patient.bp_diastolic is None:
-            return None
-            
-        target_sys = 130 if patient.ckd_stage in [CKDStage.STAGE3A, CKDStage.STAGE3B, 
-                                                CKDStage.STAGE4, CKDStage.STAGE5] else 140
+        target_sys = 130 if patient.ckd_stage in _CKD_HIGH_RISK else 140
         target_dia = 80
         
         if patient.bp_systolic >= target_sys or patient.bp_diastolic >= target_dia:
             return ClinicalFlag(
-                id="bp_tighten_control",
+                **_BP_TIGHTEN_CONTROL,
                 title=f"Blood pressure above target ({patient.bp_systolic}/{patient.bp_diastolic} mmHg)",
                 description=(
                     f"Current BP {patient.bp_systolic}/{patient.bp_diastolic} mmHg is above the target of "
                     f"{target_sys}/{target_dia} mmHg"
                 ),
                 severity=RuleSeverity.WARNING if patient.bp_systolic < 160 and patient.bp_diastolic < 100 else RuleSeverity.CRITICAL,
-                category="Blood Pressure",
-                recommendation=(
-                    "Consider optimizing antihypertensive therapy. Review current medications, "
-                    "lifestyle modifications, and adherence. Consider 24-hour ambulatory BP monitoring."
-                ),
                 rationale=(
                     "Tight blood pressure control reduces the risk of cardiovascular and microvascular complications. "
                     f"The target for {patient.diabetes_type} diabetes is <{target_sys}/{target_dia} mmHg, "
                     "with lower targets for patients with chronic kidney disease or proteinuria."
-                ),
-                citation_ids=["NG28#1.11.1", "NG203#1.2.1"],
-                affected_parameters=["bp_systolic", "bp_diastolic", "ckd_stage"]
+                )
             )
         return None
     
-    def _check_albuminuria(self, patient: PatientBase) -> Optional[ClinicalFlag]:
+    @rule(requires=HAS_ACR, provides=("albuminuria_present",))
+    def _check_albuminuria(self, patient: RuleInputs, ctx: RuleCtx) -> Optional[ClinicalFlag]:
         """Check for albuminuria based on ACR."""
-        if patient.acr is None:
-            return None
-            
         if patient.acr >= 3:  # A3 or higher
             return ClinicalFlag(
-                id="albuminuria_present",
+                **_ALBUMINURIA_PRESENT,
                 title=f"Albuminuria detected (ACR: {patient.acr} mg/mmol)",
                 description=(
                     f"Albumin:Creatinine Ratio (ACR) of {patient.acr} mg/mmol indicates "
                     "kidney damage and increased cardiovascular risk."
                 ),
-                severity=RuleSeverity.WARNING if patient.acr < 30 else RuleSeverity.CRITICAL,
-                category="Renal Health",
-                recommendation=(
-                    "Consider ACE inhibitor or ARB therapy if not contraindicated. "
-                    "Monitor renal function and potassium. Optimize glycemic and blood pressure control."
-                ),
-                rationale=(
-                    "Albuminuria is a marker of kidney damage and increased cardiovascular risk. "
-                    "Early intervention with RAAS blockade can slow progression of kidney disease."
-                ),
-                citation_ids=["NG28#1.6.1", "NG203#1.5.1"],
-                affected_parameters=["acr"]
+                severity=RuleSeverity.WARNING if patient.acr < 30 else RuleSeverity.CRITICAL
             )
         return None
     
-    def _check_hypo_risk(self, patient: PatientBase) -> Optional[ClinicalFlag]:
+    @rule(requires=HAS_MEDICATIONS, provides=("hypo_risk_from_meds",))
+    def _check_hypo_risk(self, patient: RuleInputs, ctx: RuleCtx) -> Optional[ClinicalFlag]:
         """Check for hypoglycemia risk based on medications."""
-        if not patient.medications:
-            return None
-            
-        has_insulin = any(med.is_insulin for med in patient.medications)
-        has_sulfonylurea = any(med.is_sulfonylurea for med in patient.medications)
+        has_insulin = has_sulfonylurea = False
+        for med in patient.medications:
+            has_insulin = has_insulin or med.is_insulin
+            has_sulfonylurea = has_sulfonylurea or med.is_sulfonylurea
+            if has_insulin and has_sulfonylurea:
+                break
         
         if has_insulin or has_sulfonylurea:
             meds = []
@@ -183,224 +502,112 @@ class RuleEngine:
             med_list = " and ".join(meds)
                 
             return ClinicalFlag(
-                id="hypo_risk_from_meds",
+                **_HYPO_RISK_FROM_MEDS,
                 title=f"Hypoglycemia risk from {med_list}",
                 description=(
                     f"Patient is on {med_list} which increases the risk of hypoglycemia. "
                     f"Reported {patient.hypos_last_90_days or 'unknown'} hypoglycemic episodes in last 90 days."
                 ),
                 severity=RuleSeverity.WARNING if not patient.hypos_last_90_days else RuleSeverity.CRITICAL,
-                category="Medication Safety",
-                recommendation=(
-                    "Educate on hypoglycemia recognition/treatment. Consider continuous glucose monitoring. "
-                    "Review insulin-to-carb ratios and correction factors. Consider de-escalation if appropriate."
-                ),
                 rationale=(
                     f"{med_list.capitalize()} therapy is associated with an increased risk of hypoglycemia, "
                     "which can be life-threatening. Patients should be educated on prevention, recognition, "
                     "and treatment of hypoglycemia."
-                ),
-                citation_ids=["NG17#1.8.1", "NG28#1.6.5"],
-                affected_parameters=["medications", "hypos_last_90_days"]
+                )
             )
         return None
     
-    def _check_ldl_above_target(self, patient: PatientBase) -> Optional[ClinicalFlag]:
+    @rule(requires=HAS_LDL, provides=("ldl_above_target",))
+    def _check_ldl_above_target(self, patient: RuleInputs, ctx: RuleCtx) -> Optional[ClinicalFlag]:
         """Check if LDL is above target based on risk factors."""
-        if patient.ldl_mmol is None:
-            return None
-            
         # Higher risk patients (CVD, CKD, or high QRISK) have lower targets
         high_risk = (
-            patient.ckd_stage in [CKDStage.STAGE3A, CKDStage.STAGE3B, CKDStage.STAGE4, CKDStage.STAGE5] or
-            any(cvd in [c.name.lower() for c in patient.comorbidities] 
-                for cvd in ["cvd", "cad", "mi", "stroke", "pad"])
+            patient.ckd_stage in _CKD_HIGH_RISK or
+            not _CVD_NAMES.isdisjoint(c.name for c in patient.comorbidities)
         )
         
         target = 1.4 if high_risk else 2.0  # mmol/L
         
         if patient.ldl_mmol > target:
             return ClinicalFlag(
-                id="ldl_above_target",
+                **_LDL_ABOVE_TARGET,
                 title=f"LDL-C above target ({patient.ldl_mmol:.1f} > {target} mmol/L)",
                 description=(
                     f"Current LDL-C of {patient.ldl_mmol:.1f} mmol/L is above the target of {target} mmol/L. "
                     f"Patient is considered {'high' if high_risk else 'moderate'} cardiovascular risk."
                 ),
                 severity=RuleSeverity.WARNING if patient.ldl_mmol < 3.0 else RuleSeverity.CRITICAL,
-                category="Lipid Management",
-                recommendation=(
-                    "Consider high-intensity statin therapy if not already prescribed. "
-                    "Optimize lifestyle modifications. Consider ezetimibe or PCSK9 inhibitors if targets not met."
-                ),
                 rationale=(
                     f"For patients with {patient.diabetes_type} diabetes, NICE recommends an LDL-C target of "
                     f"<{target} mmol/L to reduce cardiovascular risk, with lower targets for higher risk patients."
-                ),
-                citation_ids=["NG28#1.10.1", "CG181#1.2.1"],
-                affected_parameters=["ldl_mmol", "ckd_stage", "comorbidities"]
+                )
             )
         return None
     
-    def _check_smoking_status(self, patient: PatientBase) -> Optional[ClinicalFlag]:
+    @rule(provides=("current_smoker",))
+    def _check_smoking_status(self, patient: RuleInputs, ctx: RuleCtx) -> Optional[ClinicalFlag]:
         """Check smoking status and provide cessation support."""
         if patient.smoking_status == "Current smoker":
-            return ClinicalFlag(
-                id="current_smoker",
-                title="Current smoker - cessation support needed",
-                description="Patient reports current tobacco use, which significantly increases cardiovascular risk.",
-                severity=RuleSeverity.CRITICAL,
-                category="Lifestyle",
-                recommendation=(
-                    "Offer smoking cessation support. Consider referral to stop-smoking services. "
-                    "Discuss pharmacotherapy options (varenicline, bupropion, NRT). Set a quit date within 4 weeks."
-                ),
-                rationale=(
-                    "Smoking cessation is the single most effective intervention to reduce cardiovascular risk in "
-                    "people with diabetes. Even brief advice from a healthcare professional increases quit rates."
-                ),
-                citation_ids=["NG28#1.2.1", "PH10#1.1.1"],
-                affected_parameters=["smoking_status"]
-            )
+            return ClinicalFlag(**_CURRENT_SMOKER)
         return None
     
-    def _check_foot_screening(self, patient: PatientBase) -> Optional[ClinicalFlag]:
+    @rule(provides=("foot_screening_due", "foot_screening_overdue"))
+    def _check_foot_screening(self, patient: RuleInputs, ctx: RuleCtx) -> Optional[ClinicalFlag]:
         """Check if foot screening is due."""
         if patient.last_foot_screen is None:
-            return ClinicalFlag(
-                id="foot_screening_due",
-                title="Foot screening not documented",
-                description="No record of annual diabetic foot screening.",
-                severity=RuleSeverity.WARNING,
-                category="Preventive Care",
-                recommendation=(
-                    "Perform annual diabetic foot assessment including inspection, palpation of pulses, "
-                    "and assessment of neuropathy (10g monofilament and vibration perception). "
-                    "Document risk category and provide appropriate foot care education."
-                ),
-                rationale=(
-                    "Annual foot assessment is recommended for all people with diabetes to identify risk factors "
-                    "for foot ulceration and amputation. Early identification of risk factors can prevent complications."
-                ),
-                citation_ids=["NG19#1.2.1", "NG28#1.7.1"],
-                affected_parameters=["last_foot_screen"]
-            )
+            return ClinicalFlag(**_FOOT_SCREENING_DUE)
             
         # Check if screening is overdue (more than 15 months since last)
-        months_since_screening = (date.today().year - patient.last_foot_screen.year) * 12 + \
-                               (date.today().month - patient.last_foot_screen.month)
-                               
+        months_since_screening = _months_between(patient.last_foot_screen, ctx.today)
         if months_since_screening > 15:
             return ClinicalFlag(
-                id="foot_screening_overdue",
+                **_FOOT_SCREENING_OVERDUE,
                 title=f"Foot screening overdue (last: {patient.last_foot_screen.strftime('%b %Y')})",
-                description=f"Last foot screening was {months_since_screening} months ago.",
-                severity=RuleSeverity.WARNING,
-                category="Preventive Care",
-                recommendation=(
-                    "Schedule foot screening as soon as possible. Perform comprehensive assessment including "
-                    "inspection, palpation of pulses, and assessment of neuropathy (10g monofilament and vibration perception)."
-                ),
-                rationale=(
-                    "Annual foot assessment is recommended for all people with diabetes to identify risk factors "
-                    "for foot ulceration and amputation. Regular screening can detect problems early when they are "
-                    "most treatable."
-                ),
-                citation_ids=["NG19#1.2.1"],
-                affected_parameters=["last_foot_screen"]
+                description=f"Last foot screening was {months_since_screening} months ago."
             )
         return None
     
-    def _check_retinal_screening(self, patient: PatientBase) -> Optional[ClinicalFlag]:
+    @rule(provides=("retinal_screening_due", "retinal_screening_overdue"))
+    def _check_retinal_screening(self, patient: RuleInputs, ctx: RuleCtx) -> Optional[ClinicalFlag]:
         """Check if retinal screening is due."""
         if patient.last_retinal_screen is None:
-            return ClinicalFlag(
-                id="retinal_screening_due",
-                title="Retinal screening not documented",
-                description="No record of annual diabetic retinal screening.",
-                severity=RuleSeverity.WARNING,
-                category="Preventive Care",
-                recommendation=(
-                    "Refer for annual digital retinal photography. Ensure pupils are dilated for optimal imaging. "
-                    "Document results and any required follow-up."
-                ),
-                rationale=(
-                    "Annual retinal screening is essential for early detection of diabetic retinopathy, "
-                    "a leading cause of preventable blindness. Early treatment can prevent vision loss."
-                ),
-                citation_ids=["NG28#1.16.1", "NG17#1.13.1"],
-                affected_parameters=["last_retinal_screen"]
-            )
+            return ClinicalFlag(**_RETINAL_SCREENING_DUE)
             
         # Check if screening is overdue (more than 15 months since last)
-        months_since_screening = (date.today().year - patient.last_retinal_screen.year) * 12 + \
-                               (date.today().month - patient.last_retinal_screen.month)
-                               
+        months_since_screening = _months_between(patient.last_retinal_screen, ctx.today)
         if months_since_screening > 15:
             return ClinicalFlag(
-                id="retinal_screening_overdue",
+                **_RETINAL_SCREENING_OVERDUE,
                 title=f"Retinal screening overdue (last: {patient.last_retinal_screen.strftime('%b %Y')})",
-                description=f"Last retinal screening was {months_since_screening} months ago.",
-                severity=RuleSeverity.WARNING,
-                category="Preventive Care",
-                recommendation=(
-                    "Schedule retinal screening as soon as possible. Use mydriatic retinal photography "
-                    "for optimal image quality. Document results and any required follow-up."
-                ),
-                rationale=(
-                    "Annual retinal screening is essential for early detection of diabetic retinopathy. "
-                    "Delays in screening increase the risk of vision-threatening complications."
-                ),
-                citation_ids=["NG28#1.16.1"],
-                affected_parameters=["last_retinal_screen"]
+                description=f"Last retinal screening was {months_since_screening} months ago."
             )
         return None
     
-    def _check_renal_screening(self, patient: PatientBase) -> Optional[ClinicalFlag]:
+    @rule(provides=("renal_screening_due", "renal_screening_overdue"))
+    def _check_renal_screening(self, patient: RuleInputs, ctx: RuleCtx) -> Optional[ClinicalFlag]:
         """Check if renal screening is due."""
         if patient.last_renal_screen is None:
-            return ClinicalFlag(
-                id="renal_screening_due",
-                title="Renal screening not documented",
-                description="No record of annual renal screening (eGFR and ACR).",
-                severity=RuleSeverity.WARNING,
-                category="Preventive Care",
-                recommendation=(
-                    "Order renal function tests including eGFR and ACR. Monitor for signs of chronic kidney disease. "
-                    "Optimize blood pressure and glycemic control to preserve renal function."
-                ),
-                rationale=(
-                    "Annual assessment of renal function is recommended for all people with diabetes to detect "
-                    "early signs of diabetic kidney disease. Early intervention can slow progression."
-                ),
-                citation_ids=["NG28#1.6.1", "NG203#1.5.1"],
-                affected_parameters=["last_renal_screen", "egfr", "acr"]
-            )
+            return ClinicalFlag(**_RENAL_SCREENING_DUE)
             
         # Check if screening is overdue (more than 15 months since last)
-        months_since_screening = (date.today().year - patient.last_renal_screen.year) * 12 + \
-                               (date.today().month - patient.last_renal_screen.month)
-                               
+        months_since_screening = _months_between(patient.last_renal_screen, ctx.today)
         if months_since_screening > 15:
             return ClinicalFlag(
-                id="renal_screening_overdue",
+                **_RENAL_SCREENING_OVERDUE,
                 title=f"Renal screening overdue (last: {patient.last_renal_screen.strftime('%b %Y')})",
-                description=f"Last renal screening was {months_since_screening} months ago.",
-                severity=RuleSeverity.WARNING,
-                category="Preventive Care",
-                recommendation=(
-                    "Order renal function tests including eGFR and ACR. Consider additional testing if indicated. "
-                    "Review medications that may affect renal function."
-                ),
-                rationale=(
-                    "Regular monitoring of renal function is essential for early detection and management of "
-                    "diabetic kidney disease. Delays in screening may result in missed opportunities for intervention."
-                ),
-                citation_ids=["NG28#1.6.1"],
-                affected_parameters=["last_renal_screen"]
+                description=f"Last renal screening was {months_since_screening} months ago."
             )
         return None
 
+_worker_engine: Optional[RuleEngine] = None
+
+def _evaluate_in_worker(patient: PatientBase) -> List[ClinicalFlag]:
+    """Evaluate one patient inside a pool worker, reusing the worker's engine"""
+    global _worker_engine
+    if _worker_engine is None:
+        _worker_engine = RuleEngine()
+    return _worker_engine.evaluate_patient(patient)
+
 # Example usage:
 # rule_engine = RuleEngine()
 # flags = rule_engine.evaluate_patient(patient)
@@ -0,0 +1,83 @@
+"""
+Tests for the clinical gates on the similarity report cache
+"""
+import copy
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("openai")
+
+from rag.semantic_cache import SemanticReportCache
+
+INTAKE = {
+    "uuid": "patient-1",
+    "dob": "1970-01-01",
+    "sex": "Female",
+    "diabetes_type": "T2DM",
+    "height_cm": 165.0,
+    "weight_kg": 80.0,
+    "bp_sys": 135.0,
+    "bp_dia": 82.0,
+    "meds": [{"name": "Metformin", "dose": "500mg", "schedule": "BD", "notes": ""}],
+    "comorbidities": [],
+    "lifestyle": {"smoking": "Never"},
+    "screenings": {},
+    "labs": {
+        "hba1c_pct": 7.5,
+        "egfr": 90,
+        "creatinine_umol": 80,
+        "acr_mgmmol": 2.0,
+        "lipids": {"tc": 4.5, "ldl": 2.1, "hdl": 1.2, "tg": 1.5},
+    },
+}
+
+def edited(**changes):
+    """Copy of INTAKE with nested keys replaced, e.g. labs__egfr=25"""
+    intake = copy.deepcopy(INTAKE)
+    for path, value in changes.items():
+        *parents, key = path.split("__")
+        target = intake
+        for parent in parents:
+            target = target[parent]
+        target[key] = value
+    return intake
+
+def matches(intake):
+    values = SemanticReportCache.clinical_values
+    return SemanticReportCache.values_match(values(INTAKE), values(intake))
+
+def test_identical_intake_matches():
+    assert matches(copy.deepcopy(INTAKE))
+
+def test_change_within_tolerance_matches():
+    assert matches(edited(weight_kg=80.5))
+
+def test_changed_egfr_misses():
+    assert not matches(edited(labs__egfr=25))
+
+@pytest.mark.parametrize("key, value", [
+    ("labs__hba1c_pct", 11.5),
+    ("labs__creatinine_umol", 180),
+    ("labs__acr_mgmmol", 30.0),
+    ("labs__lipids__ldl", 3.5),
+])
+def test_changed_lab_misses(key, value):
+    assert not matches(edited(**{key: value}))
+
+@pytest.mark.parametrize("key, value", [
+    ("lifestyle", {"smoking": "Current smoker"}),
+    ("comorbidities", ["CKD"]),
+    ("screenings", {"retina_date": "2024-01-01"}),
+    ("goals", "Lose weight"),
+    ("meds", [{"name": "Metformin", "dose": "1g", "schedule": "BD", "notes": ""}]),
+])
+def test_changed_context_misses(key, value):
+    assert not matches(edited(**{key: value}))
+
+def test_missing_lab_misses():
+    assert not matches(edited(labs__egfr=None))
+
+def test_values_survive_round_trip():
+    import orjson
+    values = SemanticReportCache.clinical_values(INTAKE)
+    assert SemanticReportCache.values_match(orjson.loads(orjson.dumps(values)), values)
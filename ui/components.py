@@ -6,25 +6,15 @@ from typing import Dict, List, Any, Optional
 from datetime import datetime
 import pandas as pd
 
-def create_conflict_resolver(form_data: Dict, pdf_data: Dict, confidence_scores: Dict) -> Dict:
+def find_conflicts(form_data: Dict, pdf_data: Dict, confidence_scores: Dict) -> List[Dict]:
     """
-    Create conflict resolution interface for form vs PDF data
-    
-    Args:
-        form_data: Data from form inputs
-        pdf_data: Data extracted from PDF
-        confidence_scores: PDF extraction confidence per field
+    Find fields whose form and PDF values differ significantly
     
     Returns:
-        Dict of resolved conflicts {field: 'form'|'pdf'}
+        List of conflict rows for create_conflict_resolver
     """
-    st.subheader("🔄 Resolve Data Conflicts")
-    st.info("Some values differ between your form entries and the uploaded PDF. Please choose which to use.")
-    
-    conflicts = {}
     conflict_data = []
     
-    # Find conflicts between form and PDF data
     for field, pdf_value in pdf_data.items():
         if field.startswith('_'):  # Skip metadata fields
             continue
@@ -42,6 +32,29 @@ def create_conflict_resolver(form_data: Dict, pdf_data: Dict, confidence_scores:
                     'field_key': field
                 })
     
+    return conflict_data
+
+def create_conflict_resolver(form_data: Dict, pdf_data: Dict, confidence_scores: Dict,
+                             conflict_data: Optional[List[Dict]] = None) -> Dict:
+    """
+    Create conflict resolution interface for form vs PDF data
+    
+    Args:
+        form_data: Data from form inputs
+        pdf_data: Data extracted from PDF
+        confidence_scores: PDF extraction confidence per field
+        conflict_data: Precomputed find_conflicts() rows, to skip detection
+    
+    Returns:
+        Dict of resolved conflicts {field: 'form'|'pdf'}
+    """
+    st.subheader("🔄 Resolve Data Conflicts")
+    st.info("Some values differ between your form entries and the uploaded PDF. Please choose which to use.")
+    
+    conflicts = {}
+    if conflict_data is None:
+        conflict_data = find_conflicts(form_data, pdf_data, confidence_scores)
+    
     if not conflict_data:
         st.success("✅ No conflicts found between form and PDF data")
         return {}
@@ -115,11 +128,11 @@ def _format_value(value: Any) -> str:
     else:
         return str(value)
 
-def create_clinical_snapshot_cards(patient_data: Dict, rules: Dict):
-    """Create clinical snapshot cards with traffic light indicators"""
-    from utils.formatters import create_clinical_snapshot
-    
-    snapshot = create_clinical_snapshot(patient_data, rules)
+def create_clinical_snapshot_cards(patient_data: Dict, rules: Dict, snapshot: Optional[Dict] = None):
+    """Create clinical snapshot cards with traffic light indicators; pass snapshot to reuse a cached one"""
+    if snapshot is None:
+        from utils.formatters import create_clinical_snapshot
+        snapshot = create_clinical_snapshot(patient_data, rules)
     
     if not snapshot:
         return
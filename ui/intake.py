@@ -0,0 +1,69 @@
+"""
+Patient intake form configuration: widget options, defaults and the measurement grid
+Kept out of app.py so it is built once per process rather than on every Streamlit rerun
+"""
+from datetime import date
+from typing import List
+
+import pandas as pd
+import streamlit as st
+from pydantic import TypeAdapter
+
+from rules.schemas.report import MedEntry
+
+# Vitals, events and labs edited in one grid: key -> (label, min, max, default)
+MEASUREMENT_FIELDS = {
+    'bp_sys': ("Systolic BP (mmHg)", 70, 250, 120),
+    'bp_dia': ("Diastolic BP (mmHg)", 40, 150, 80),
+    'heart_rate': ("Heart Rate (bpm)", 40, 200, 72),
+    'waist_cm': ("Waist Circumference (cm)", 50, 200, 85),
+    'hypos_90d': ("Hypoglycemic episodes (last 90 days)", 0, 100, 0),
+    'severe_hypos_90d': ("Severe hypoglycemic episodes (last 90 days)", 0, 20, 0),
+    'dka_12m': ("DKA episodes (last 12 months)", 0, 10, 0),
+    'hba1c_pct': ("HbA1c (%)", 4.0, 20.0, 7.5),
+    'fpg_mmol': ("Fasting Glucose (mmol/L)", 2.0, 30.0, 5.5),
+    'ppg2h_mmol': ("2h Post-meal Glucose (mmol/L)", 3.0, 40.0, 8.0),
+    'tc': ("Total Cholesterol (mmol/L)", 2.0, 15.0, 5.0),
+    'ldl': ("LDL Cholesterol (mmol/L)", 1.0, 10.0, 2.5),
+    'hdl': ("HDL Cholesterol (mmol/L)", 0.5, 3.0, 1.2),
+    'tg': ("Triglycerides (mmol/L)", 0.5, 20.0, 1.5),
+    'egfr': ("eGFR (mL/min/1.73m²)", 5, 150, 90),
+    'creatinine_umol': ("Creatinine (μmol/L)", 40, 800, 80),
+    'acr_mgmmol': ("ACR (mg/mmol)", 0.0, 100.0, 2.0),
+}
+MEASUREMENTS_DF = pd.DataFrame(
+    {
+        'Measurement': [label for label, _, _, _ in MEASUREMENT_FIELDS.values()],
+        'Value': [float(default) for _, _, _, default in MEASUREMENT_FIELDS.values()],
+    },
+    index=list(MEASUREMENT_FIELDS)
+)
+MEASUREMENT_MIN = pd.Series({key: lo for key, (_, lo, _, _) in MEASUREMENT_FIELDS.items()})
+MEASUREMENT_MAX = pd.Series({key: hi for key, (_, _, hi, _) in MEASUREMENT_FIELDS.items()})
+MEASUREMENT_COLUMN_CONFIG = {
+    'Measurement': st.column_config.TextColumn(disabled=True),
+    'Value': st.column_config.NumberColumn(min_value=0.0, step=0.1, required=True),
+}
+
+# Intake widget options and defaults, built once rather than on every rerun
+DEFAULT_DOB = date(1980, 1, 1)
+SEX_OPTIONS = ("Male", "Female", "Other")
+DIABETES_TYPE_OPTIONS = ("T1DM", "T2DM")
+SMOKING_OPTIONS = ("Never", "Former", "Current")
+ACTIVITY_OPTIONS = ("Sedentary", "Light", "Moderate", "Very Active")
+DIET_OPTIONS = ("Standard", "Low Carb", "Mediterranean", "Vegetarian", "Other")
+
+# Validates and dumps the parsed medication rows in pydantic-core rather than per-field Python
+MEDS_ADAPTER = TypeAdapter(List[MedEntry])
+
+def parse_medications(text: str) -> List[dict]:
+    """Parse the medications textarea, one "name - dose" per line, into meds dicts for PatientIntake"""
+    # partition stops at the first " - ", so hyphenated names (e.g. Co-codamol) stay whole;
+    # whitespace is stripped by MedEntry
+    rows = [
+        {'name': name, 'dose': dose}
+        for line in (text or '').splitlines()
+        if line.strip()
+        for name, _, dose in [line.partition(' - ')]
+    ]
+    return MEDS_ADAPTER.dump_python(MEDS_ADAPTER.validate_python(rows))
@@ -0,0 +1,27 @@
+"""
+Static UI text for the Streamlit app
+Kept out of app.py so it is built once per process rather than on every Streamlit rerun
+"""
+from datetime import datetime
+
+MISSING_API_KEY_MESSAGE = (
+    "⚠️ **OPENAI_API_KEY** not configured.\n\n"
+    "Add it in **Settings → Advanced settings → Secrets** as:\n\n"
+    "```toml\nOPENAI_API_KEY = \"sk-...\"\n```\n"
+    "Then rerun the app."
+)
+
+PYMUPDF_MISSING_MESSAGE = (
+    "PyMuPDF (fitz) is not available. "
+    "Add `PyMuPDF==1.26.3` to requirements.txt and redeploy."
+)
+
+APP_TITLE = "🩺 Diabetes Consultant AI Assistant"
+APP_SUBTITLE = "### Schema-Locked Single-Pass Clinical Report Generator"
+
+# The build year is fixed for the life of the process
+FOOTER = (
+    "🔬 **Powered by:** NICE/BDA Guidelines • "
+    "🏥 **For:**  Digital Health • "
+    f"⚡ **Built:** {datetime.now().strftime('%Y')}"
+)
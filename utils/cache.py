@@ -0,0 +1,97 @@
+"""
+On-disk JSON caches for LLM responses and generated reports
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Optional
+import orjson
+
+class DiskCache:
+    """Store JSON-serializable values on disk, one file per key"""
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+
+    @staticmethod
+    def make_key(*parts: str) -> str:
+        """Build a SHA-256 cache key from the given string parts"""
+        return hashlib.sha256("|".join(parts).encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value for key, or None on a miss"""
+        try:
+            return orjson.loads((self.directory / f"{key}.json").read_bytes())
+        except (FileNotFoundError, orjson.JSONDecodeError):
+            return None
+
+    def set(self, key: str, value: Any):
+        """Write value to the cache atomically"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        # Write to a unique temp file then rename so readers never see partial JSON
+        tmp_file = self.directory / f"{key}.{uuid.uuid4().hex}.tmp"
+        tmp_file.write_bytes(orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS))
+        os.replace(tmp_file, self.directory / f"{key}.json")
+
+class ReportStore:
+    """Generated reports keyed by intake hash, in SQLite so they outlive the process"""
+
+    def __init__(self, path: str = ".cache/reports.db"):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # One connection shared across Streamlit script threads, serialized by the lock
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS reports (hash TEXT PRIMARY KEY, created TEXT NOT NULL, report BLOB NOT NULL)"
+            )
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the stored report for key, or None on a miss"""
+        with self._lock:
+            row = self._conn.execute("SELECT report FROM reports WHERE hash = ?", (key,)).fetchone()
+        return orjson.loads(row[0]) if row else None
+
+    def set(self, key: str, value: Any):
+        """Insert or replace the report for key"""
+        blob = orjson.dumps(value)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO reports (hash, created, report) VALUES (?, ?, ?)",
+                (key, datetime.now().isoformat(), blob)
+            )
+
+class EmbeddingStore:
+    """Raw embedding bytes keyed by content hash, in SQLite so repeat texts skip the API"""
+
+    def __init__(self, path: str = ".cache/embeddings.db"):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS cache (hash TEXT PRIMARY KEY, vec BLOB NOT NULL)")
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return the stored vector bytes for key, or None on a miss"""
+        with self._lock:
+            row = self._conn.execute("SELECT vec FROM cache WHERE hash = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, vec: bytes):
+        """Insert or replace the vector bytes for key"""
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO cache (hash, vec) VALUES (?, ?)", (key, vec))
+
+    def set_many(self, items):
+        """Insert or replace several (key, vector bytes) pairs in one transaction"""
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO cache (hash, vec) VALUES (?, ?)", items)
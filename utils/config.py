@@ -0,0 +1,16 @@
+"""
+Secrets and environment settings for the Streamlit app
+"""
+import os
+from functools import lru_cache
+
+import streamlit as st
+
+@lru_cache(maxsize=None)
+def get_secret(name: str, default=None):
+    """Read a setting once per process, preferring Streamlit Secrets on Cloud and falling back to OS env"""
+    try:
+        val = st.secrets.get(name)
+    except Exception:
+        val = None
+    return val if val is not None else os.getenv(name, default)
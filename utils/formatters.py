@@ -4,7 +4,7 @@ Formatters for diabetes report system - rounding, unit conversion, traffic light
 import math
 from datetime import datetime, date
 from typing import Dict, Any, Optional
-from rules import get_traffic_light_status, get_traffic_light_emoji
+from rules import get_traffic_light_status, get_traffic_light_statuses, get_traffic_light_emoji
 
 def round_sensibly(value: Optional[float], decimal_places: int = 1) -> Optional[float]:
     """Round numbers sensibly to avoid long decimals"""
@@ -58,7 +58,15 @@ def format_glucose_mmol(value: Optional[float]) -> str:
 
 def get_traffic_light_display(metric_name: str, value: float, rules: Dict) -> Dict[str, str]:
     """Get traffic light status with emoji and text"""
-    status = get_traffic_light_status(metric_name, value, rules)
+    return _traffic_light_display(get_traffic_light_status(metric_name, value, rules))
+
+def get_traffic_light_displays(values: Dict[str, float], rules: Dict) -> Dict[str, Dict[str, str]]:
+    """Get traffic light displays for several metrics, evaluating the thresholds in one pass"""
+    statuses = get_traffic_light_statuses(values, rules)
+    return {metric: _traffic_light_display(status) for metric, status in statuses.items()}
+
+def _traffic_light_display(status: str) -> Dict[str, str]:
+    """Build the emoji/text display for a traffic light status"""
     emoji = get_traffic_light_emoji(status)
     
     status_text = {
@@ -192,27 +200,30 @@ Page 1 of 4
 │ Metric     │ Latest       │ Target (Adults, T1DM) │ Status  │
 ├────────────┼──────────────┼───────────────────────┼─────────┤"""
 
+    metrics = {'hbA1c': hba1c_pct, 'bp_sys': bp_sys, 'bmi': bmi, 'ldl': ldl}
+    traffic = get_traffic_light_displays({name: value for name, value in metrics.items() if value}, rules)
+    
     # HbA1c row
     if hba1c_pct:
         hba1c_display = format_hba1c_display(hba1c_pct)
-        hba1c_traffic = get_traffic_light_display('hbA1c', hba1c_pct, rules)
+        hba1c_traffic = traffic['hbA1c']
         report_text += f"\n│ HbA1c      │ {hba1c_display:<12} │ ≤ 6.5–7.0% (if safe)  │ {hba1c_traffic['display']:<7} │"
     
     # Blood pressure row
     if bp_sys and bp_dia:
         bp_display = format_blood_pressure(bp_sys, bp_dia)
-        bp_traffic = get_traffic_light_display('bp_sys', bp_sys, rules)
+        bp_traffic = traffic['bp_sys']
         report_text += f"\n│ BP         │ {bp_display:<12} │ < 135/85 mmHg         │ {bp_traffic['display']:<7} │"
     
     # BMI row
     if bmi:
-        bmi_traffic = get_traffic_light_display('bmi', bmi, rules)
+        bmi_traffic = traffic['bmi']
         report_text += f"\n│ BMI        │ {bmi:<12} │ 18.5–24.9 kg/m²       │ {bmi_traffic['display']:<7} │"
     
     # LDL row
     if ldl:
         ldl_display = f"{ldl} mmol/L"
-        ldl_traffic = get_traffic_light_display('ldl', ldl, rules)
+        ldl_traffic = traffic['ldl']
         report_text += f"\n│ LDL-C      │ {ldl_display:<12} │ < 2.0 (high CV risk)  │ {ldl_traffic['display']:<7} │"
     
     # eGFR row
@@ -393,47 +404,46 @@ END OF REPORT
 def create_clinical_snapshot(patient_data: Dict, rules: Dict) -> Dict:
     """Create at-a-glance clinical snapshot for UI cards"""
     labs = patient_data.get('labs', {})
+    hba1c = labs.get('hba1c_pct')
+    bp_sys = patient_data.get('bp_sys')
+    bp_dia = patient_data.get('bp_dia')
+    bmi = calculate_bmi(patient_data.get('weight_kg', 0), patient_data.get('height_cm', 0))
+    ldl = labs.get('lipids', {}).get('ldl')
+    
+    metrics = {'hbA1c': hba1c, 'bp_sys': bp_sys if bp_dia else None, 'bmi': bmi, 'ldl': ldl}
+    traffic = get_traffic_light_displays({name: value for name, value in metrics.items() if value}, rules)
     
     snapshot = {}
     
     # HbA1c card
-    if labs.get('hba1c_pct'):
-        hba1c = labs['hba1c_pct']
-        traffic = get_traffic_light_display('hbA1c', hba1c, rules)
+    if hba1c:
         snapshot['hba1c'] = {
             'value': format_hba1c_display(hba1c),
-            'traffic': traffic,
+            'traffic': traffic['hbA1c'],
             'target': '≤ 7.0%'
         }
     
     # Blood pressure card
-    if patient_data.get('bp_sys') and patient_data.get('bp_dia'):
-        bp_sys = patient_data['bp_sys']
-        bp_dia = patient_data['bp_dia']
-        traffic = get_traffic_light_display('bp_sys', bp_sys, rules)
+    if bp_sys and bp_dia:
         snapshot['bp'] = {
             'value': format_blood_pressure(bp_sys, bp_dia),
-            'traffic': traffic,
+            'traffic': traffic['bp_sys'],
             'target': '< 135/85'
         }
     
     # BMI card
-    bmi = calculate_bmi(patient_data.get('weight_kg', 0), patient_data.get('height_cm', 0))
     if bmi:
-        traffic = get_traffic_light_display('bmi', bmi, rules)
         snapshot['bmi'] = {
             'value': f"{bmi} kg/m²",
-            'traffic': traffic,
+            'traffic': traffic['bmi'],
             'target': '18.5-24.9'
         }
     
     # LDL card
-    ldl = labs.get('lipids', {}).get('ldl')
     if ldl:
-        traffic = get_traffic_light_display('ldl', ldl, rules)
         snapshot['ldl'] = {
             'value': f"{ldl} mmol/L",
-            'traffic': traffic,
+            'traffic': traffic['ldl'],
             'target': '< 2.0'
         }
     
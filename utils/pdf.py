@@ -2,6 +2,7 @@
 PDF export utility using ReportLab to render consultant-grade reports
 """
 import os
+import threading
 from typing import Dict
 from pathlib import Path
 from datetime import datetime
@@ -52,6 +53,8 @@ class PDFGenerator:
     def __init__(self):
         self.styles = getSampleStyleSheet()
         self._setup_custom_styles()
+        # One shared instance serves every session; ReportLab makes no thread-safety promises
+        self._lock = threading.Lock()
     
     def _setup_custom_styles(self):
         """Setup custom styles for NHS report formatting"""
@@ -103,27 +106,28 @@ class PDFGenerator:
         Returns:
             PDF content as bytes
         """
-        buffer = BytesIO()
+        with self._lock:
+            buffer = BytesIO()
         
-        # Create PDF document
-        doc = SimpleDocTemplate(
-            buffer,
-            pagesize=A4,
-            rightMargin=0.75*inch,
-            leftMargin=0.75*inch,
-            topMargin=1*inch,
-            bottomMargin=0.75*inch,
-            canvasmaker=NumberedCanvas
-        )
+            # Create PDF document
+            doc = SimpleDocTemplate(
+                buffer,
+                pagesize=A4,
+                rightMargin=0.75*inch,
+                leftMargin=0.75*inch,
+                topMargin=1*inch,
+                bottomMargin=0.75*inch,
+                canvasmaker=NumberedCanvas
+            )
         
-        # Generate text report
-        text_report = render_text_report(report_data, patient_data, rules)
+            # Generate text report
+            text_report = render_text_report(report_data, patient_data, rules)
         
-        # Build PDF content
-        story = self._build_pdf_story(text_report, patient_data, report_data)
+            # Build PDF content
+            story = self._build_pdf_story(text_report, patient_data, report_data)
         
-        # Build PDF
-        doc.build(story)
+            # Build PDF
+            doc.build(story)
         
         buffer.seek(0)
         return buffer.getvalue()